@@ -0,0 +1,91 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+
+from random import randint, seed
+import os
+import shutil
+
+# Runs committed and aborted transactions, then kills the process without closing the database.
+# crash_tester_part_2.py reopens it and checks that recovery kept exactly the committed changes.
+
+shutil.rmtree('./CRASH', ignore_errors=True)
+
+db = Database()
+# A small bufferpool, so pages are written back while the transactions run
+db.bufferpool_size = 50
+db.open('./CRASH')
+
+# creating grades table
+grades_table = db.create_table('Grades', 5, 0)
+
+# create a query class for the grades table
+query = Query(grades_table)
+
+number_of_records = 1000
+number_of_transactions = 100
+num_threads = 8
+
+seed(3562901)
+
+# records as inserted, then the updates of the aborted and the committed transactions.
+# Every third key gets the same update in an aborted transaction and then a committed one.
+keys = [92106429 + i for i in range(number_of_records)]
+records = {key: [key] + [randint(0, 20) for _ in range(4)] for key in keys}
+aborted_updates = {key: [None, None] + [randint(0, 20) for _ in range(3)] for key in keys}
+committed_updates = {
+    key: aborted_updates[key] if key % 3 == 0 else [None, None] + [randint(0, 20) for _ in range(3)]
+    for key in keys
+}
+aborted_inserts = [[92106429 + number_of_records + i, 1, 2, 3, 4] for i in range(number_of_transactions)]
+committed_inserts = [[92106429 + 2 * number_of_records + i, 5, 6, 7, 8] for i in range(number_of_transactions)]
+
+
+def run_transactions(transactions):
+    transaction_workers = [TransactionWorker() for _ in range(num_threads)]
+    for i, transaction in enumerate(transactions):
+        transaction_workers[i % num_threads].add_transaction(transaction)
+    for transaction_worker in transaction_workers:
+        transaction_worker.run()
+    for transaction_worker in transaction_workers:
+        transaction_worker.join()
+    return sum(transaction_worker.result for transaction_worker in transaction_workers)
+
+
+# Each transaction works on the keys that are equal to its number modulo number_of_transactions,
+# so transactions of the same phase never wait for each other's locks
+
+# insert every record
+transactions = [Transaction() for _ in range(number_of_transactions)]
+for key in keys:
+    transactions[key % number_of_transactions].add_query(query.insert, grades_table, *records[key])
+committed = run_transactions(transactions)
+db.checkpoint()
+
+# update, delete and insert, then abort on an update of a key that doesn't exist
+transactions = [Transaction() for _ in range(number_of_transactions)]
+for key in keys:
+    transaction = transactions[key % number_of_transactions]
+    transaction.add_query(query.update, grades_table, key, *aborted_updates[key])
+    if key % 10 == 2:
+        transaction.add_query(query.delete, grades_table, key)
+for i, transaction in enumerate(transactions):
+    transaction.add_query(query.insert, grades_table, *aborted_inserts[i])
+    transaction.add_query(query.update, grades_table, -(i + 1), None, 0, None, None, None)
+aborted = number_of_transactions - run_transactions(transactions)
+
+# commit the updates, some of them the same as the aborted ones, with deletes and inserts
+transactions = [Transaction() for _ in range(number_of_transactions)]
+for key in keys:
+    transaction = transactions[key % number_of_transactions]
+    transaction.add_query(query.update, grades_table, key, *committed_updates[key])
+    if key % 10 == 1:
+        transaction.add_query(query.delete, grades_table, key)
+for i, transaction in enumerate(transactions):
+    transaction.add_query(query.insert, grades_table, *committed_inserts[i])
+committed += run_transactions(transactions)
+
+print('Committed', committed, 'and aborted', aborted, 'transactions')
+print('Crashing')
+os._exit(0)
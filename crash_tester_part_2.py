@@ -0,0 +1,56 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, seed
+
+# Reopens the database crash_tester_part_1.py killed, and checks every key against the
+# committed transactions only. Run part 1 first.
+
+db = Database()
+db.open('./CRASH')
+
+# Getting the existing Grades table
+grades_table = db.get_table('Grades')
+
+# create a query class for the grades table
+query = Query(grades_table)
+
+number_of_records = 1000
+number_of_transactions = 100
+
+seed(3562901)
+
+# re-generate the records and updates of part 1
+keys = [92106429 + i for i in range(number_of_records)]
+records = {key: [key] + [randint(0, 20) for _ in range(4)] for key in keys}
+aborted_updates = {key: [None, None] + [randint(0, 20) for _ in range(3)] for key in keys}
+committed_updates = {
+    key: aborted_updates[key] if key % 3 == 0 else [None, None] + [randint(0, 20) for _ in range(3)]
+    for key in keys
+}
+aborted_inserts = [[92106429 + number_of_records + i, 1, 2, 3, 4] for i in range(number_of_transactions)]
+committed_inserts = [[92106429 + 2 * number_of_records + i, 5, 6, 7, 8] for i in range(number_of_transactions)]
+
+# what the committed transactions leave: None for a key that must not exist
+expected = {}
+for key in keys:
+    columns = records[key]
+    for i, value in enumerate(committed_updates[key]):
+        if value is not None:
+            columns[i] = value
+    expected[key] = None if key % 10 == 1 else columns
+for columns in aborted_inserts:
+    expected[columns[0]] = None
+for columns in committed_inserts:
+    expected[columns[0]] = columns
+
+score = len(expected)
+for key, correct in expected.items():
+    result = query.select(key, 0, [1, 1, 1, 1, 1])
+    result = result[0].columns if result else None
+    if correct != result:
+        print('select error on primary key', key, ':', result, ', correct:', correct)
+        score -= 1
+print('Score', score, '/', len(expected))
+
+db.close()
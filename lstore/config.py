@@ -3,5 +3,21 @@ DATA_SIZE = 8
 RECORDS_PER_PAGE = PAGE_SIZE // DATA_SIZE
 MAX_BASE_PAGES = 16
 BUFFERPOOL_SIZE = 500
-MERGE_THRESHOLD = 5000
-DEFAULT_DB_PATH = "./defualt_db"
\ No newline at end of file
+BUFFERPOOL_POLICY = "lru"
+DIRTY_HIGH_WATERMARK = 0.25  # fraction of dirty frames that wakes the background writer
+DIRTY_LOW_WATERMARK = 0.1  # the background writer stops once the fraction drops to this
+GROUP_COMMIT_WINDOW = 0.002  # seconds a commit leader waits for other in-flight transactions
+GROUP_COMMIT_MAX = 64  # commits that end the group commit window early
+LOG_SEGMENT_SIZE = 16 * 1024 * 1024  # bytes per log segment file, checkpoints drop whole segments
+CHECKPOINT_LOG_SIZE = 64 * 1024 * 1024  # log bytes appended since the last checkpoint that start a new one
+CHECKPOINT_INTERVAL = 10  # seconds between checks of the log size by the checkpointer
+CHECKPOINT_BATCH = 32  # dirty pages a checkpoint claims per acquisition of the bufferpool lock
+MERGE_THRESHOLD = 5000  # tail records appended to a page range since its last merge that make it due
+MERGE_WORKERS = 2  # threads of a database's merge scheduler
+MERGE_THROTTLE_RATIO = 2.0  # merges back off while recent updates are this many times slower than usual
+MERGE_BACKOFF = 0.01  # seconds a throttled merge waits before checking again
+MERGE_MAX_BACKOFF = 0.5  # seconds a merge waits at most for updates to speed up
+DEFAULT_DB_PATH = "./defualt_db"
+BPLUS_TREE_DEGREE = 64
+BULK_LOAD_FILL_FACTOR = 0.9
+LAZY_OPEN = True  # tables of an opened database load their pages and build their indexes on demand
@@ -1,17 +1,36 @@
 import os
 import msgpack
-from lstore.config import BUFFERPOOL_SIZE, MAX_BASE_PAGES, RECORDS_PER_PAGE, DEFAULT_DB_PATH
-from lstore.table import Table, Record
-from threading import RLock
+from lstore.config import BUFFERPOOL_SIZE, BUFFERPOOL_POLICY, DIRTY_HIGH_WATERMARK, DIRTY_LOW_WATERMARK, MAX_BASE_PAGES, RECORDS_PER_PAGE, DEFAULT_DB_PATH, CHECKPOINT_LOG_SIZE, CHECKPOINT_INTERVAL, CHECKPOINT_BATCH, LAZY_OPEN
+from lstore.table import Table, Record, LazyPageDirectory
+from lstore.page import BasePage, TailPage, LogicalPage
+from lstore.replacement import create_policy
+from lstore.stats import BufferpoolStats
+from lstore.page_store import PageStore, NodeStore, NULL
+from lstore.log import LogManager
+from lstore.recovery import Recovery
+from lstore.merge import MergeScheduler
+from threading import Lock, RLock, Condition, Thread, Event, current_thread
+from collections import OrderedDict
+import time
 
 
 
 class Database:
-    def __init__(self):
+    def __init__(self, replacement_policy=BUFFERPOOL_POLICY):
         self.tables = []
         self.path = DEFAULT_DB_PATH
         self.bufferpool = None
+        self.log = None  # write-ahead log, forced on commit
+        self.opening = False  # tables recreated while opening aren't logged
+        self.logged_tables = set()  # tables whose creation is in the last checkpoint or the log
+        self.checkpoint_lock = RLock()  # one checkpoint at a time
+        self.checkpointer = None  # thread starting a checkpoint once enough log is written
+        self.checkpointer_stop = None
+        self.checkpoint_mark = 0  # log bytes appended when the last checkpoint finished
+        self.merge_scheduler = None  # merges the page ranges with the most updates in the background
         self.bufferpool_size = BUFFERPOOL_SIZE
+        self.replacement_policy = replacement_policy  # "lru", "clock", "2q" or "arc"
+        self.lazy_open = LAZY_OPEN  # load stored pages and page directory entries on first access
         self.lock_manager = LockManager()
         self.open(DEFAULT_DB_PATH)
         #self.create_grades_table()
@@ -28,26 +47,109 @@ class Database:
         if not os.path.exists(path):
             os.makedirs(path)
 
-        # Initialize the bufferpool
-        self.bufferpool = Bufferpool(self.bufferpool_size, self.path)
-
-        # Load database metadata if it exists
-        metadata_path = os.path.join(path, "db_metadata.msg")
-        if os.path.exists(metadata_path):
-            with open(metadata_path, "rb") as f:
-                table_metadata = msgpack.unpackb(f.read(), raw=False)
-
-            # Recreate tables from metadata
-            for table_info in table_metadata:
-                name = table_info["name"]
-                table = self.create_table(
-                    name, table_info["num_columns"], table_info["key"]
-                )
+        # Initialize the write-ahead log and the bufferpool
+        self._stop_checkpointer()
+        if self.merge_scheduler:
+            self.merge_scheduler.stop()
+        self.merge_scheduler = MergeScheduler()
+        # Background index builds read through the bufferpool, let them finish whether they fail or not
+        for table in self.tables:
+            table.index.ready.wait()
+        if self.bufferpool:
+            self.bufferpool.close()
+        if self.log:
+            self.log.close()
+        self.tables = []
+        self.log = LogManager(os.path.join(path, "wal.log"))
+        self.bufferpool = Bufferpool(self.bufferpool_size, self.path, self.replacement_policy, self.log)
+
+        self.logged_tables = set()
+        self.opening = True
+        try:
+            # Load database metadata if it exists
+            metadata_path = os.path.join(path, "db_metadata.msg")
+            if os.path.exists(metadata_path):
+                with open(metadata_path, "rb") as f:
+                    table_metadata = msgpack.unpackb(f.read(), raw=False)
+
+                # Recreate tables from metadata
+                for table_info in table_metadata:
+                    name = table_info["name"]
+                    table = self.create_table(
+                        name, table_info["num_columns"], table_info["key"]
+                    )
+
+                    # Load table data if the directory exists
+                    table_path = os.path.join(path, name)
+                    if os.path.exists(table_path):
+                        self.load_table_data(table, table_info)
+
+            # Bring the last checkpoint forward with the log
+            Recovery(self).run()
+        finally:
+            self.opening = False
+
+        self.checkpoint_mark = 0
+        self.checkpointer_stop = Event()
+        self.checkpointer = Thread(target=self._checkpoint_when_due, args=(self.checkpointer_stop,), daemon=True)
+        self.checkpointer.start()
+
+    def checkpoint(self):
+        """
+        Fuzzy checkpoint, taken while queries keep running.
+        Logs a begin record, then writes back the frames that were dirty at that point a batch at
+        a time. Each table then briefly holds its lock while its remaining dirty frames are written
+        and its segment file is checkpointed together with its page directory.
+        The checkpoint record lists the dirty page table and the running transactions. Recovery
+        starts at the oldest LSN among them and the begin record, and older log segments are deleted.
+        """
+        with self.checkpoint_lock:
+            if self.log is None:
+                raise Exception("Database is not open")
+            begin_lsn = self.log.append({"type": "begin_checkpoint"})
+            dirty_pages = self.bufferpool.dirty_page_table()
+            active = self.log.active_transactions()
+
+            # Most of the writing happens here, without blocking queries
+            self.bufferpool.flush_pages(dirty_pages)
+
+            table_metadata = []
+            for table in list(self.tables):
+                with table.lock:
+                    self.bufferpool.flush_table(table.name)
+                    self.save_table_data(table)
+                table_metadata.append({"name": table.name, "num_columns": table.num_columns, "key": table.key})
+            self.save_msg(os.path.join(self.path, "db_metadata.msg"), table_metadata)
+
+            redo_lsn = min([begin_lsn, *dirty_pages.values(), *active.values()])
+            self.log.append({
+                "type": "checkpoint",
+                "begin": begin_lsn,
+                "redo": redo_lsn,
+                "dirty_pages": [[table_name, *page_id, lsn] for (table_name, page_id), lsn in dirty_pages.items()],
+                "active": [[transaction_id, lsn] for transaction_id, lsn in active.items()],
+            })
+            self.log.flush()
+            self.log.truncate_before(redo_lsn)
+            self.checkpoint_mark = self.log.bytes_appended
+            return redo_lsn
+
+    def _checkpoint_when_due(self, stop):
+        # Checkpointer loop: checkpoint once CHECKPOINT_LOG_SIZE bytes were logged since the last one
+        while not stop.wait(CHECKPOINT_INTERVAL):
+            if self.log is None or self.log.bytes_appended - self.checkpoint_mark < CHECKPOINT_LOG_SIZE:
+                continue
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"Checkpoint failed: {e}")
 
-                # Load table data if the directory exists
-                table_path = os.path.join(path, name)
-                if os.path.exists(table_path):
-                    self.load_table_data(table, table_info)
+    def _stop_checkpointer(self):
+        if self.checkpointer is not None:
+            self.checkpointer_stop.set()
+            if self.checkpointer is not current_thread():
+                self.checkpointer.join()
+            self.checkpointer = None
 
     def close(self):
         """
@@ -55,8 +157,18 @@ class Database:
         """
         if not self.path:
             raise Exception("Database is not open")
+        self._stop_checkpointer()
+        self.merge_scheduler.stop()
+
+        # Background index builds read through the bufferpool
+        for table in self.tables:
+            table.index.wait_ready()
 
-        # Save table metadata and data
+        # Flush all bufferpool pages to disk
+        if self.bufferpool:
+            self.bufferpool.reset()
+
+        # Save table metadata and data, checkpointing each table
         table_metadata = []
         for table in self.tables:
             table_info = {
@@ -68,18 +180,22 @@ class Database:
             self.save_table_data(table)
 
         # Save database metadata
-        metadata_path = os.path.join(self.path, "db_metadata.msg")
-        with open(metadata_path, "wb") as f:
-            f.write(msgpack.packb(table_metadata, use_bin_type=True))
+        self.save_msg(os.path.join(self.path, "db_metadata.msg"), table_metadata)
 
-        # Flush all bufferpool pages to disk
         if self.bufferpool:
-            self.bufferpool.reset()
+            self.bufferpool.close()
+
+        # Everything the log describes is on disk now
+        if self.log:
+            self.log.truncate()
+            self.log.close()
 
         # Clear in-memory state
         self.tables = []
+        self.logged_tables = set()
         self.path = None
         self.bufferpool = None
+        self.log = None
 
     """
     # Creates a new table
@@ -98,15 +214,34 @@ class Database:
             if table.name == name:
                 raise Exception(f"Table {name} already exists")
 
-        # Create a new table
+        # Create a new table and its segment file
         table = Table(name, num_columns, key)
+        store = self.bufferpool.attach(name, num_columns)
 
         # Give the table a reference to this database
         table.database = self
 
+        # Page its indexes through the bufferpool, reloading the key column's index if it was
+        # saved with the table's last checkpoint
+        generation = None
+        if self.opening and store.metadata is not None:
+            generation = store.metadata["table"].get("index_generation")
+        table.index.attach(self.bufferpool, generation)
+
+        if self.opening:
+            self.logged_tables.add(name)
         self.tables.append(table)
         return table
 
+    def log_table(self, table):
+        """
+        Logs the creation of a table before the first logged query on it, so recovery can recreate it.
+        Tables only used outside transactions are never logged, and are lost unless the database is closed.
+        """
+        if self.log and table.name not in self.logged_tables:
+            self.log.append({"type": "create_table", "name": table.name, "num_columns": table.num_columns, "key": table.key})
+            self.logged_tables.add(table.name)
+
     """
     # Deletes the specified table
     """
@@ -116,6 +251,11 @@ class Database:
         for i, table in enumerate(self.tables):
             if table.name == name:
                 self.tables.pop(i)
+                self.merge_scheduler.forget(table)
+                if self.log and not self.opening and name in self.logged_tables:
+                    self.logged_tables.discard(name)
+                    self.log.append({"type": "drop_table", "name": name})
+                    self.log.flush()
                 return
 
         raise Exception(f"Table {name} does not exist")
@@ -139,65 +279,86 @@ class Database:
             os.makedirs(table_path)
             return
 
-        # Load table metadata
-        table_meta_path = os.path.join(table_path, "tb_metadata.msg")
-        if os.path.exists(table_meta_path):
-            with open(table_meta_path, "rb") as f:
-                metadata = msgpack.unpackb(f.read(), raw=False)
-            table.num_columns = metadata["num_columns"]
-            table.key = metadata["key"]
-        else:
+        # Load table metadata from the last checkpoint of the table's segment file
+        store = self.bufferpool.attach(table.name, table.num_columns)
+        if store.metadata is None:
             return
+        metadata = store.metadata["table"]
+        table.num_columns = metadata["num_columns"]
+        table.key = metadata["key"]
 
-        # Calculate number of page ranges
-        num_pages = metadata.get("num_pages", 0)
-        page_range_count = (num_pages + MAX_BASE_PAGES - 1) // MAX_BASE_PAGES
-
-        # Initialize page ranges and load base page metadata
-        for pr_idx in range(page_range_count):
+        # One page range for every range with a stored page
+        page_ids = store.page_ids()
+        while len(table.page_ranges) < max((page_range for _, page_range, _ in page_ids), default=-1) + 1:
             table.add_page_range(table.num_columns)
-            page_range = table.page_ranges[pr_idx]
-
-            # Load base page metadata
-            base_idx = 0
-            while True:
-                page_id = ("base", pr_idx, base_idx)
-                page_path = os.path.join(table_path, f"base_{pr_idx}_{base_idx}.msg")
-                if not os.path.exists(page_path):
-                    break
-                page_range.add_base_page(table.num_columns)
-                base_page = page_range.base_pages[base_idx]
-                page_data = self.bufferpool.get_page(page_id, table.name, table.num_columns)
-                # Pre-load metadata, not columns
-                base_page.indirection = page_data.get("indirection", [])
-                base_page.rid = page_data.get("rid", [None] * RECORDS_PER_PAGE)
-                base_page.start_time = page_data.get("timestamp", [])
-                base_page.schema_encoding = page_data.get("schema_encoding", [])
-                base_page.num_records = len(page_data["columns"][0]) if "columns" in page_data and page_data["columns"] else 0
-                self.bufferpool.unpin_page(page_id, table.name)
-                base_idx += 1
-
-            # Initialize tail pages as empty (load lazily)
-            tail_idx = 0
-            while os.path.exists(os.path.join(table_path, f"tail_{pr_idx}_{tail_idx}.msg")):
-                page_range.add_tail_page(table.num_columns)
-                tail_idx += 1
-
-        # Create indices for all columns
-        for x in range(table.num_columns):
-            table.index.create_index(x)
-
-        # Load Page Directory and rebuild them
-        page_directory_path = os.path.join(table_path, "pg_directory.msg")
-        if os.path.exists(page_directory_path):
-            with open(page_directory_path, "rb") as f:
-                pg_data = msgpack.unpackb(f.read(), raw=False)
-            for rid_str, columns in zip(pg_data["rid"], pg_data["data"]):
-                rid = tuple(rid_str)
-                key = columns[table.key]
-                record = Record(rid, key, columns)
-                table.page_directory[rid] = record
-                table.index.insert(key, rid)
+
+        # The page directory is rebuilt from the stored pages, less the rids deleted from it.
+        # A lazy open loads a page's records the first time one of them is looked up.
+        deleted = store.read_deleted()
+        if self.lazy_open:
+            table.page_directory = LazyPageDirectory(
+                table.key, page_ids, deleted,
+                lambda page_id: self._read_page(table, page_id),
+                lambda page_id, column: self.bufferpool.read_column(page_id, table.name, column),
+            )
+
+        for pr_idx, page_range in enumerate(table.page_ranges):
+            # Base and tail pages are numbered without gaps, stop at the first one not stored
+            while ("base", pr_idx, len(page_range.base_pages)) in store:
+                page_id = ("base", pr_idx, len(page_range.base_pages))
+                page_range.base_pages.append(self._open_page(table, BasePage, page_id, deleted))
+                page_range.num_base_pages += 1
+                table.append_cursor = (pr_idx, len(page_range.base_pages) - 1)
+            while ("tail", pr_idx, len(page_range.tail_pages)) in store:
+                page_id = ("tail", pr_idx, len(page_range.tail_pages))
+                page_range.tail_pages.append(self._open_page(table, TailPage, page_id, deleted))
+                page_range.num_tail_pages += 1
+
+        # Bulk load indices for all columns from the latest version of every record,
+        # except the key column if its saved index was reloaded
+        columns = [x for x in range(table.num_columns) if not (table.index.loaded and x == table.key)]
+        if self.lazy_open:
+            table.index.build_in_background(columns)
+        else:
+            table.index.build(columns)
+
+    def _open_page(self, table, page_class, page_id, deleted):
+        # In-memory mirror of a stored page. A lazy open leaves its metadata to be read on first access.
+        if self.lazy_open:
+            return page_class.unloaded(table.num_columns, self._page_loader(table, page_id))
+        page = page_class(table.num_columns)
+        page_data = self._read_page(table, page_id)
+        self._fill_page(page, page_data)
+        table.page_directory.add_page(page_data, table.key, deleted)
+        return page
+
+    def _page_loader(self, table, page_id):
+        lock = Lock()
+
+        def load(page):
+            with lock:
+                if page.loader is not None:
+                    self._fill_page(page, self._read_page(table, page_id))
+                    page.loader = None
+        return load
+
+    def _read_page(self, table, page_id):
+        page_data = self.bufferpool.get_page(page_id, table.name, table.num_columns)
+        self.bufferpool.unpin_page(page_id, table.name)
+        return page_data
+
+    def _fill_page(self, page, page_data):
+        # Pre-load metadata, not columns
+        # Copy the lists, inserts append to the bufferpool page and the mirror separately
+        page.indirection = list(page_data["indirection"])
+        page.rid = list(page_data["rid"])
+        page.start_time = list(page_data["timestamp"])
+        page.schema_encoding = list(page_data["schema_encoding"])
+        page.num_records = len(page_data["rid"])
+        if isinstance(page, TailPage):
+            page.tps = page_data["tps"] or 0
+        if "pages" not in page.__dict__:
+            page.pages = [LogicalPage() for _ in range(page.num_cols)]
 
     # Need to implement later
     def save_table_data(self, table):
@@ -213,35 +374,44 @@ class Database:
             ),
         }
 
-        # Save table metadata
-        with open(os.path.join(table_path, "tb_metadata.msg"), "wb") as f:
-            f.write(msgpack.packb(metadata, use_bin_type=True))
-
-        # Save each page separately
+        # Save each page separately. A page the bufferpool already wrote back is newer than its
+        # in-memory mirror (tail mirrors don't even hold column values), so only pages it never
+        # wrote are saved from the mirror. reset() writes the pages that are still dirty.
+        store = self.bufferpool.attach(table.name, table.num_columns)
         for pr_idx, page_range in enumerate(table.page_ranges):
             for page_idx, page in enumerate(page_range.base_pages):
-                page_id = f"base_{pr_idx}_{page_idx}"
-                self.save_page(table, page, page_id)
+                page_id = ("base", pr_idx, page_idx)
+                if page_id not in store:
+                    self.save_page(table, page, page_id)
 
             for page_idx, page in enumerate(page_range.tail_pages):
-                page_id = f"tail_{pr_idx}_{page_idx}"
-                self.save_page(table, page, page_id)
-
-        # Save page directory separately
-        pg_directory = {
-            "rid": list(table.page_directory.keys()),
-            "data": [record.columns for record in table.page_directory.values()],
-        }
-        with open(os.path.join(table_path, "pg_directory.msg"), "wb") as f:
-            f.write(msgpack.packb(pg_directory, use_bin_type=True))
+                page_id = ("tail", pr_idx, page_idx)
+                if page_id not in store:
+                    self.save_page(table, page, page_id)
+
+        # The index file is checkpointed first, a reopen only reloads it if the table's checkpoint
+        # that follows records the same generation
+        metadata["index_generation"] = table.index.save()
+
+        # Checkpoint the pages together with the table metadata and the rids deleted from the page
+        # directory since the last checkpoint, so a reopen always sees a matching set
+        deleted = table.page_directory.changes()
+        store.checkpoint({"table": metadata}, deleted)
+        table.page_directory.mark_saved(deleted)
+
+    def save_msg(self, path, data):
+        """Write a msgpack file atomically, through a temporary file and a rename."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(msgpack.packb(data, use_bin_type=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
 
     def save_page(self, table, page, page_id):
         """Helper function to save a single page."""
-        table_path = os.path.join(self.path, table.name)
-        page_path = os.path.join(table_path, f"{page_id}.msg")
-
         page_data = {
-            "columns": [col.read(0, col.num_records) for col in page.pages],
+            "columns": [col.column().tolist() for col in page.pages],
             "indirection": page.indirection,
             "rid": page.rid,
             "timestamp": page.start_time,
@@ -249,49 +419,125 @@ class Database:
             "tps": getattr(page, "tps", None),
         }
 
-        with open(page_path, "wb") as f:
-            f.write(msgpack.packb(page_data, use_bin_type=True))
+        self.bufferpool.attach(table.name, table.num_columns).write(page_id, page_data)
 
 
 class Bufferpool:
-    def __init__(self, size, path):
+    def __init__(self, size, path, policy=BUFFERPOOL_POLICY, log=None):
         self.size = size  # maximum number of pages in memory
         self.path = path  # database path
+        self.log = log  # write-ahead log, forced before any page is written back
         self.pages = {}  # page_id -> (page_data, is_dirty)
-        self.page_paths = {}  # page_id -> disk_path
+        self.stores = {}  # table_name -> PageStore holding the table's pages on disk
+        self.index_stores = {}  # table_name -> NodeStore holding the nodes of the table's indexes
         self.pins = {}  # page_id -> pin count
-        self.access_times = {}  # page_id -> last_access_time
-        self.access_counter = 0  # counter for tracking access order
+        self.policy = create_policy(policy, size)  # picks which unpinned page to evict
+        self.counters = BufferpoolStats()  # hits, misses, evictions, I/O volume and latency
         self.lock = RLock()
 
-    def get_page(self, page_id, table_name, num_columns=None):
+        # Background writer: keeps the dirty fraction between the watermarks so eviction finds clean victims
+        self.dirty = OrderedDict()  # dirty frame -> LSN when it was dirtied (its recLSN), oldest first
+        self.flushing = set()  # frames the writer is writing outside the lock
+        self.high_watermark = max(1, int(size * DIRTY_HIGH_WATERMARK))
+        self.low_watermark = int(size * DIRTY_LOW_WATERMARK)
+        self.flush_needed = Condition(self.lock)
+        self.flushed = Condition(self.lock)
+        self.stopping = False
+        self.writer = Thread(target=self._write_behind, daemon=True)
+        self.writer.start()
+
+    def attach(self, table_name, num_columns):
+        """
+        Open (or create) the segment file of a table and return its PageStore.
+        """
+        with self.lock:
+            store = self.stores.get(table_name)
+            if store is None:
+                store = PageStore(os.path.join(self.path, table_name, "pages.seg"), num_columns)
+                self.stores[table_name] = store
+            return store
+
+    def attach_index(self, table_name, degree):
+        """
+        Open (or create) the index file of a table and return its NodeStore.
+        Its nodes are pages of the table with ids ("node", column, node id).
+        """
+        with self.lock:
+            store = self.index_stores.get(table_name)
+            if store is None:
+                store = NodeStore(os.path.join(self.path, table_name, "index.seg"), degree)
+                self.index_stores[table_name] = store
+            return store
+
+    def _store(self, table_name, page_id):
+        # The file a page of the table lives in
+        stores = self.index_stores if page_id[0] == "node" else self.stores
+        return stores.get(table_name)
+
+    def close(self):
+        """
+        Stop the background writer, then sync and close every segment file.
+        Call reset() first to write back dirty pages.
+        """
+        with self.lock:
+            self.stopping = True
+            self.flush_needed.notify()
+        self.writer.join()
+        with self.lock:
+            for store in [*self.stores.values(), *self.index_stores.values()]:
+                store.sync()
+                store.close()
+            self.stores.clear()
+            self.index_stores.clear()
+
+    def stats(self, reset=False):
+        """
+        Snapshot of the global and per-table counters, current pin counts and I/O latency histograms.
+        Pass reset=True to start counting from zero after taking the snapshot.
+        """
+        with self.lock:
+            snapshot = self.counters.snapshot(self.pins)
+            snapshot["global"]["resident_pages"] = len(self.pages)
+            snapshot["global"]["capacity"] = self.size
+        if reset:
+            self.counters.reset()
+        return snapshot
+
+    def reset_stats(self):
+        self.counters.reset()
+
+    def get_page(self, page_id, table_name, num_columns=None, sequential=False):
         """
         Get a page from the bufferpool. If not in memory, load from disk.
         Returns the page data and pins the page.
+        Pass sequential=True from scans so their pages don't evict the hot working set.
         """
         composite_key = (table_name, page_id)
         with self.lock:
-            # If page is in bufferpool, access it and update access time
+            # A frame claimed for a write-back is encoded outside the lock, so nobody may change it
+            # until the write lands
+            self._wait_flushed(composite_key)
+            # If page is in bufferpool, pin it so it is no longer an eviction candidate
             if composite_key in self.pages:
-                self.access_counter += 1
-                self.access_times[composite_key] = self.access_counter
                 self.pins[composite_key] = self.pins.get(composite_key, 0) + 1
+                self.policy.pinned(composite_key, sequential)
+                self.counters.add(table_name, "hits")
                 return self.pages[composite_key][0]  # Return page_data
-
-        # Construct the disk file path
-        page_path = self._construct_page_path(table_name, page_id)
-        with self.lock:
-            self.page_paths[composite_key] = page_path
-
-        # Load page from disk if it exists, otherwise create empty page
-        if os.path.exists(page_path):
+            self.counters.add(table_name, "misses")
+
+        # Load page from the table's segment file if it was written, otherwise create empty page
+        store = self._store(table_name, page_id)
+        if store is None and num_columns is not None:
+            store = self.attach(table_name, num_columns)
+        page_data = None
+        if store is not None and page_id in store:
             try:
-                with open(page_path, "rb") as f:
-                    page_data = msgpack.unpackb(f.read(), raw=False)
+                start = time.perf_counter()
+                page_data = store.read(page_id)
+                self.counters.record_load(table_name, time.perf_counter() - start, store.read_size)
             except Exception as e:
                 print(f"Error reading page from disk: {e}")
-                page_data = self._create_empty_page(num_columns)
-        else:
+        if page_data is None:
             page_data = self._create_empty_page(num_columns)
             
         with self.lock:
@@ -301,20 +547,62 @@ class Bufferpool:
             # Insert the page into the bufferpool
             self.pages[composite_key] = (page_data, False)  # Not dirty initially
             self.pins[composite_key] = 1  # Pin on load
-            self.access_counter += 1
-            self.access_times[composite_key] = self.access_counter
+            self.policy.pinned(composite_key, sequential)
 
         return page_data
 
+    def read_column(self, page_id, table_name, column, sequential=False):
+        """
+        Read-only access to one column of a page without loading or pinning it.
+        A resident page is read from its frame, any other page through the memory map of the
+        table's segment file. Returns None if the page doesn't exist.
+        The result is only valid until the page is next written, so read it right away.
+        """
+        columns = self.read_columns(page_id, table_name, (column,), sequential)
+        return None if columns is None else columns[0]
+
+    def read_columns(self, page_id, table_name, columns, sequential=False):
+        """
+        read_column for several columns of the same page with one lookup.
+        Returns a list with the values of every column, or None if the page doesn't exist.
+        """
+        composite_key = (table_name, page_id)
+        with self.lock:
+            frame = self.pages.get(composite_key)
+            if frame is not None:
+                # Count the access with the replacement policy like a pin and unpin would
+                self.policy.pinned(composite_key, sequential)
+                if self.pins.get(composite_key, 0) == 0:
+                    self.policy.unpinned(composite_key)
+                self.counters.add(table_name, "hits")
+                page_columns = frame[0].get("columns") or []
+                return [page_columns[column] if column < len(page_columns) else [] for column in columns]
+
+            store = self.stores.get(table_name)
+            if store is None or page_id not in store:
+                return None
+            self.counters.add(table_name, "mapped_reads")
+            return [store.column(page_id, column) for column in columns]
+
+    def read_value(self, page_id, table_name, column, index, sequential=False):
+        """
+        Read one value through read_column. Returns None if it doesn't exist.
+        """
+        values = self.read_column(page_id, table_name, column, sequential)
+        if values is None or index >= len(values):
+            return None
+        value = values[index]
+        return None if value == NULL else value
+
     def set_page(self, page_id, table_name, page_data, num_columns=None):
         """
         Update or insert a page in the bufferpool and mark it as dirty.
         """
         composite_key = (table_name, page_id)
         
-        # If bufferpool is full, evict pages until space is available
+        # If bufferpool is full and the page is new, evict pages until space is available
         with self.lock:
-            while len(self.pages) >= self.size:
+            while composite_key not in self.pages and len(self.pages) >= self.size:
                 try:
                     self.evict_page()
                 except Exception:
@@ -322,52 +610,57 @@ class Bufferpool:
                     if self.pages:
                         # Find the page with the lowest pin count (even if it's 1)
                         min_pin_page = min(self.pins, key=self.pins.get)
+                        self._wait_flushed(min_pin_page)
+                        if min_pin_page not in self.pages:
+                            continue
+                        self.counters.add(min_pin_page[0], "forced_evictions")
                         self.write_dirty(min_pin_page, self.pages[min_pin_page][0])
                         del self.pages[min_pin_page]
-                        del self.page_paths[min_pin_page]
                         del self.pins[min_pin_page]
-                        del self.access_times[min_pin_page]
+                        self.policy.remove(min_pin_page)
                     else:
                         raise Exception("Cannot evict any pages from bufferpool")
 
-        # Construct page path and store it
-        page_path = self._construct_page_path(table_name, page_id)
-        self.page_paths[composite_key] = page_path
+            # Writing back a page the caller already pinned is not a new access
+            if self.pins.get(composite_key, 0) == 0:
+                self.policy.pinned(composite_key)
 
-        # Add page to bufferpool
-        self.pages[composite_key] = (page_data, True)  # Mark as dirty
-        self.pins[composite_key] = 1
-        self.access_counter += 1
-        self.access_times[composite_key] = self.access_counter
+            # Add page to bufferpool
+            self.pages[composite_key] = (page_data, True)  # Mark as dirty
+            self.pins[composite_key] = 1
+            if composite_key not in self.dirty:
+                self.dirty[composite_key] = self._rec_lsn()
+                if len(self.dirty) >= self.high_watermark:
+                    self.flush_needed.notify()
 
     def evict_page(self):
         """
         Evict the least recently used unpinned page.
         If the page is dirty, write it to disk first.
         """
-        # Find the least recently used unpinned page
+        # Ask the replacement policy for an unpinned victim
         with self.lock:
-            comp_key_evict = None
-            oldest_access = float("inf")
-
-            for comp_key, access_time in list(self.access_times.items()):
-                if self.pins.get(comp_key, 0) == 0 and access_time < oldest_access:
-                    oldest_access = access_time
-                    comp_key_evict = comp_key
-
+            comp_key_evict = self.policy.victim()
             if comp_key_evict is None:
                 raise Exception("No unpinned page available for eviction.")
 
+            # A page the background writer is writing can't leave until the write lands,
+            # otherwise a miss could read the old copy from disk
+            if comp_key_evict in self.flushing:
+                self._wait_flushed(comp_key_evict)
+                if comp_key_evict not in self.pages or self.pins.get(comp_key_evict, 0) > 0:
+                    return  # taken by someone else while waiting, the caller tries again
+
             # If the page is dirty, write it to disk
             page_data, is_dirty = self.pages[comp_key_evict]
             if is_dirty:
                 self.write_dirty(comp_key_evict, page_data)
 
             # Remove the page from the bufferpool
+            self.counters.add(comp_key_evict[0], "evictions")
             del self.pages[comp_key_evict]
-            del self.page_paths[comp_key_evict]
             del self.pins[comp_key_evict]
-            del self.access_times[comp_key_evict]
+            self.dirty.pop(comp_key_evict, None)
 
     def unpin_page(self, page_id, table_name = None):
         """
@@ -379,6 +672,26 @@ class Bufferpool:
         with self.lock:
             if composite_key in self.pins and self.pins[composite_key] > 0:
                 self.pins[composite_key] -= 1
+                # Once unpinned, the page becomes an eviction candidate
+                if self.pins[composite_key] == 0:
+                    self.policy.unpinned(composite_key)
+                    if composite_key in self.dirty and len(self.dirty) >= self.high_watermark:
+                        self.flush_needed.notify()
+
+    def discard_page(self, page_id, table_name):
+        """
+        Drop a page from the bufferpool and its file without writing it back, once it is no longer used.
+        """
+        composite_key = (table_name, page_id)
+        with self.lock:
+            self._wait_flushed(composite_key)
+            if self.pages.pop(composite_key, None) is not None:
+                self.pins.pop(composite_key, None)
+                self.dirty.pop(composite_key, None)
+                self.policy.remove(composite_key)
+            store = self._store(table_name, page_id)
+            if store is not None:
+                store.delete(page_id)
 
     def _create_empty_page(self, num_columns):
         """Create an empty page data structure with the expected format."""
@@ -396,54 +709,143 @@ class Bufferpool:
         Write a dirty page back to disk.
         """
         with self.lock:
-            if composite_key in self.page_paths:
-                path = self.page_paths[composite_key]
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(path), exist_ok=True)
-
-                # Serialize and write data
-                with open(path, "wb") as f:
-                    f.write(msgpack.packb(page_data, use_bin_type=True))
-
+            if self._write(composite_key, page_data):
                 # Mark page as clean
                 if composite_key in self.pages:
                     self.pages[composite_key] = (page_data, False)
+                self.dirty.pop(composite_key, None)
+
+    def _write(self, composite_key, page_data):
+        # Encode the page into its fixed-size slot and write it with one pwrite
+        table_name, page_id = composite_key
+        store = self._store(table_name, page_id)
+        if store is None:
+            return False
+        # Write-ahead rule: the log records behind the page reach disk first
+        if self.log is not None:
+            self.log.flush()
+        start = time.perf_counter()
+        store.write(page_id, page_data)
+        self.counters.record_write(table_name, time.perf_counter() - start, store.slot_size)
+        return True
+
+    def _wait_flushed(self, composite_key):
+        # Block until the background writer is done with the page
+        while composite_key in self.flushing:
+            self.flushed.wait()
+
+    def _rec_lsn(self):
+        # Changes to a frame dirtied now are logged at this LSN or later
+        return self.log.next_lsn if self.log is not None else 0
+
+    def dirty_page_table(self):
+        """
+        Returns {(table_name, page_id): recLSN} for every dirty frame.
+        """
+        with self.lock:
+            return dict(self.dirty)
+
+    def _claim(self, composite_keys):
+        # Mark the frames clean and hand them to the caller to write outside the lock.
+        # Only unpinned frames may be claimed, and get_page waits for the write, so the page
+        # data doesn't change while it is encoded. Call with the lock held.
+        batch = []
+        for composite_key in composite_keys:
+            del self.dirty[composite_key]
+            page_data, _ = self.pages[composite_key]
+            self.pages[composite_key] = (page_data, False)
+            self.flushing.add(composite_key)
+            batch.append((composite_key, page_data))
+        return batch
+
+    def _write_claimed(self, batch, counter):
+        for composite_key, page_data in batch:
+            try:
+                self._write(composite_key, page_data)
+                self.counters.add(composite_key[0], counter)
+            except Exception as e:
+                print(f"Error writing page in the background: {e}")
+                with self.lock:
+                    if composite_key in self.pages:
+                        self.pages[composite_key] = (self.pages[composite_key][0], True)
+                        self.dirty[composite_key] = self._rec_lsn()
+            finally:
+                with self.lock:
+                    self.flushing.discard(composite_key)
+                    self.flushed.notify_all()
+
+    def flush_pages(self, composite_keys):
+        """
+        Write back the given frames that are still dirty, CHECKPOINT_BATCH at a time.
+        The lock is only held to claim a batch, so queries keep running during the writes.
+        Pinned frames are skipped.
+        """
+        composite_keys = list(composite_keys)
+        for start in range(0, len(composite_keys), CHECKPOINT_BATCH):
+            with self.lock:
+                batch = self._claim([
+                    composite_key for composite_key in composite_keys[start:start + CHECKPOINT_BATCH]
+                    if composite_key in self.dirty and self.pins.get(composite_key, 0) == 0
+                ])
+            self._write_claimed(batch, "checkpoint_writes")
+
+    def flush_table(self, table_name):
+        """
+        Write back every dirty frame of a table, and wait for its background writes to land.
+        The caller holds the table lock, so nothing dirties the table's frames meanwhile.
+        """
+        with self.lock:
+            while any(composite_key[0] == table_name for composite_key in self.flushing):
+                self.flushed.wait()
+            for composite_key in [key for key in self.dirty if key[0] == table_name]:
+                page_data, _ = self.pages[composite_key]
+                self.write_dirty(composite_key, page_data)
+                self.counters.add(table_name, "checkpoint_writes")
+
+    def _write_behind(self):
+        """
+        Background writer loop. Sleeps until the dirty frames reach the high watermark, then writes
+        the oldest unpinned ones until they are down to the low watermark.
+        A frame is marked clean before its write starts, so a set_page during the write
+        marks it dirty again and nothing is lost.
+        """
+        while True:
+            with self.lock:
+                while not self.stopping and len(self.dirty) < self.high_watermark:
+                    self.flush_needed.wait()
+                if self.stopping:
+                    return
+                batch = []
+                for composite_key in self.dirty:
+                    if len(self.dirty) - len(batch) <= self.low_watermark:
+                        break
+                    if self.pins.get(composite_key, 0) == 0:
+                        batch.append(composite_key)
+                batch = self._claim(batch)
+                if not batch:
+                    # Every dirty frame is pinned, wait for one to be unpinned
+                    self.flush_needed.wait()
+                    continue
+
+            self._write_claimed(batch, "background_writes")
 
     def reset(self):
         """
         Write all dirty pages to disk and clear the bufferpool.
         """
         with self.lock:
+            # Let in-flight background writes land before the frames go away
+            while self.flushing:
+                self.flushed.wait()
             for composite_key, (page_data, is_dirty) in self.pages.items():
                 if is_dirty:
                     self.write_dirty(composite_key, page_data)
 
             # Clear all bufferpool data structures
             self.pages.clear()
-            self.page_paths.clear()
             self.pins.clear()
-            self.access_times.clear()
-            self.access_counter = 0
-
-    def _construct_page_path(self, table_name, page_id):
-        """
-        Standardize page path construction.
-        """
-        # Create a structured path for different page types
-        if isinstance(page_id, tuple):
-            # Handle structured page IDs (e.g., (range_id, page_type, page_num))
-            page_type = page_id[0]
-            if page_type == "base":
-                return os.path.join(
-                    self.path, table_name, f"base_{page_id[1]}_{page_id[2]}.msg"
-                )
-            elif page_type == "tail":
-                return os.path.join(
-                    self.path, table_name, f"tail_{page_id[1]}_{page_id[2]}.msg"
-                )
-
-        # Default case for simple page IDs
-        return os.path.join(self.path, table_name, f"{page_id}.msg")
+            self.dirty.clear()
+            self.policy.clear()
 
 class LockManager:
     def __init__(self):
@@ -0,0 +1,77 @@
+from collections import deque
+from threading import Lock
+
+
+class EpochManager:
+    """
+    Epoch-based reclamation for things a writer replaces while readers may still be using them.
+    A reader runs inside reader(), which registers it in the current epoch. A writer first
+    publishes the replacement, then passes a function that frees the old version to retire().
+    Every retire ends the current epoch, and the function runs once the readers that started in
+    that epoch or an earlier one have all finished. Readers never wait for writers.
+    """
+
+    def __init__(self):
+        self.epoch = 0
+        self.readers = {}  # epoch -> number of unfinished readers that started in it
+        self.retired = deque()  # (epoch, free function), oldest first
+        self.reclaimed = 0
+        self.lock = Lock()
+
+    def reader(self):
+        return EpochReader(self)
+
+    def enter(self):
+        with self.lock:
+            epoch = self.epoch
+            self.readers[epoch] = self.readers.get(epoch, 0) + 1
+            return epoch
+
+    def exit(self, epoch):
+        with self.lock:
+            self.readers[epoch] -= 1
+            if not self.readers[epoch]:
+                del self.readers[epoch]
+            ready = self._ready()
+        self._free(ready)
+
+    def retire(self, free):
+        """
+        Run free() once no reader that may have seen the old version is left.
+        Call it after the new version is published.
+        """
+        with self.lock:
+            self.retired.append((self.epoch, free))
+            self.epoch += 1
+            ready = self._ready()
+        self._free(ready)
+
+    def _ready(self):
+        # Take the functions retired before the oldest running reader's epoch. Call with the lock held.
+        oldest = min(self.readers, default=self.epoch)
+        ready = []
+        while self.retired and self.retired[0][0] < oldest:
+            ready.append(self.retired.popleft()[1])
+        return ready
+
+    def _free(self, ready):
+        # Outside the lock, a free function may take other locks
+        for free in ready:
+            free()
+            self.reclaimed += 1
+
+
+class EpochReader:
+    # Context manager running a reader in the current epoch of an EpochManager
+
+    __slots__ = ("epochs", "epoch")
+
+    def __init__(self, epochs):
+        self.epochs = epochs
+
+    def __enter__(self):
+        self.epoch = self.epochs.enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.epochs.exit(self.epoch)
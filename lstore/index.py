@@ -1,92 +1,369 @@
+from bisect import bisect_left, bisect_right
+from threading import Event, Thread
+from lstore.config import BPLUS_TREE_DEGREE, BULK_LOAD_FILL_FACTOR
+
 # B Plus Tree Implementation
-# Internal nodes store keys while leaf nodes store (key, rid) pairs
+# Internal nodes store separator keys and children while leaf nodes store keys and rids in parallel lists
 class BPlusTreeNode:
-    def __init__(self, leaf=False):
+    def __init__(self, leaf=False, node_id=None):
         self.leaf = leaf
         self.keys = []
+        self.values = []
         self.children = []
         self.next = None
         self.parent = None
+        self.node_id = node_id  # page of the node in a paged tree
+
+    # Keys and rids of a leaf. With pin=True they are changed in place and handed back to store(),
+    # or the leaf is release()d if they end up unchanged.
+    def contents(self, pin=False):
+        return self.keys, self.values
+
+    def store(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+    def release(self):
+        pass
+
+# Leaf of a paged tree. Only its id and links stay resident, its keys and rids are an index page
+# in the bufferpool, read back from the table's index file once evicted.
+class PagedLeaf(BPlusTreeNode):
+    def __init__(self, pager, node_id):
+        self.leaf = True
+        self.children = []
+        self.next = None
+        self.parent = None
+        self.pager = pager
+        self.node_id = node_id
+
+    @property
+    def keys(self):
+        return self.pager.read(self.node_id)["keys"]
+
+    @property
+    def values(self):
+        return self.pager.read(self.node_id)["values"]
+
+    def contents(self, pin=False):
+        # A pinned page stays in the bufferpool until store() or release(), so nothing writes it
+        # back or evicts it halfway through a change
+        page = self.pager.read(self.node_id, pin)
+        return page["keys"], page["values"]
+
+    def store(self, keys, values):
+        # Writing the lists back marks the page dirty and unpins it
+        self.pager.write(self.node_id, {"level": 0, "keys": keys, "values": values})
+
+    def release(self):
+        self.pager.unpin(self.node_id)
+
+# Keeps the nodes of one column's tree as pages ("node", column, node id) of the table in the bufferpool
+class NodePager:
+    def __init__(self, bufferpool, table_name, column_number):
+        self.bufferpool = bufferpool
+        self.table_name = table_name
+        self.column_number = column_number
+        self.next_id = 0
+
+    def allocate(self):
+        node_id = self.next_id
+        self.next_id += 1
+        return node_id
+
+    def read(self, node_id, pin=False):
+        # With pin=True the caller unpins the page, through write() or unpin()
+        page_id = ("node", self.column_number, node_id)
+        page = self.bufferpool.get_page(page_id, self.table_name)
+        if not pin:
+            self.bufferpool.unpin_page(page_id, self.table_name)
+        return page
+
+    def unpin(self, node_id):
+        self.bufferpool.unpin_page(("node", self.column_number, node_id), self.table_name)
+
+    def write(self, node_id, page):
+        page_id = ("node", self.column_number, node_id)
+        self.bufferpool.set_page(page_id, self.table_name, page)
+        self.bufferpool.unpin_page(page_id, self.table_name)
+
+    def free(self, node_id):
+        self.bufferpool.discard_page(("node", self.column_number, node_id), self.table_name)
 
 class BPlusTree:
-    def __init__(self, t):
+    def __init__(self, t, pager=None):
         # Start with an empty node, root is the root node and t is the minimum degree of the tree
-        self.root = BPlusTreeNode(True)
+        # With a pager the leaves are paged through the bufferpool and only the internal nodes stay in memory
         self.t = t
+        self.pager = pager
+        self.root = self._new_node(leaf=True)
+
+    # New node, a leaf holding keys and values
+    def _new_node(self, leaf, keys=None, values=None):
+        if self.pager is None:
+            node = BPlusTreeNode(leaf)
+        elif leaf:
+            node = PagedLeaf(self.pager, self.pager.allocate())
+        else:
+            return BPlusTreeNode(leaf, self.pager.allocate())
+        if leaf:
+            node.store(keys or [], values or [])
+        return node
+
+    def _free(self, node):
+        if self.pager is not None:
+            self.pager.free(node.node_id)
+
+    # Bulk loading operation for building a whole tree from (key, rid) pairs bottom-up
+    @classmethod
+    def bulk_load(cls, t, pairs, fill_factor=BULK_LOAD_FILL_FACTOR, pager=None):
+        tree = cls(t, pager)
+        # Sort once; later pairs go first among equal keys, the same order repeated inserts produce
+        pairs = sorted(reversed(list(pairs)), key=lambda pair: pair[0])
+        if not pairs:
+            return tree
+        tree._free(tree.root)
+
+        # Pack the leaves, keeping at least t keys per leaf so deletes don't underflow right away
+        max_keys = (2 * t) - 1
+        per_leaf = max(t, min(max_keys, round(max_keys * fill_factor)))
+        leaves = []
+        low_keys = []
+        for chunk in tree._packed_chunks(pairs, per_leaf, t, max_keys, key=lambda pair: pair[0]):
+            leaf = tree._new_node(True, [key for key, _ in chunk], [rid for _, rid in chunk])
+            if leaves:
+                leaves[-1].next = leaf
+            leaves.append(leaf)
+            low_keys.append(chunk[0][0])
+
+        # Build the internal levels until a single root is left
+        level = leaves
+        max_children = 2 * t
+        per_node = max(t + 1, min(max_children, round(max_children * fill_factor)))
+        while len(level) > 1:
+            parents = []
+            parent_low_keys = []
+            for group in tree._packed_chunks(list(range(len(level))), per_node, t + 1, max_children):
+                node = tree._new_node(leaf=False)
+                node.children = [level[i] for i in group]
+                # The separator for each child after the first is the smallest key below it
+                node.keys = [low_keys[i] for i in group[1:]]
+                for child in node.children:
+                    child.parent = node
+                parents.append(node)
+                parent_low_keys.append(low_keys[group[0]])
+            level = parents
+            low_keys = parent_low_keys
+
+        tree.root = level[0]
+        return tree
+
+    # Rebuild a paged tree from the pages its save() left, reading only the internal nodes
+    @classmethod
+    def load(cls, t, pager, root_id):
+        tree = cls.__new__(cls)
+        tree.t = t
+        tree.pager = pager
+        leaves = []
+
+        def read(node_id, level):
+            if level == 0:
+                leaf = PagedLeaf(pager, node_id)
+                leaves.append(leaf)
+                return leaf
+            page = pager.read(node_id)
+            node = BPlusTreeNode(leaf=False, node_id=node_id)
+            node.keys = list(page["keys"])
+            for child_id in page["children"]:
+                child = read(child_id, level - 1)
+                child.parent = node
+                node.children.append(child)
+            return node
+
+        tree.root = read(root_id, pager.read(root_id)["level"])
+        for leaf, next_leaf in zip(leaves, leaves[1:]):
+            leaf.next = next_leaf
+        return tree
+
+    # Write the internal nodes of a paged tree to their pages, the leaves are written as they change
+    def save(self):
+        if self.pager is None:
+            return
+
+        def write(node):
+            if node.leaf:
+                return 0
+            level = write(node.children[0]) + 1
+            for child in node.children[1:]:
+                write(child)
+            self.pager.write(node.node_id, {
+                "level": level,
+                "keys": list(node.keys),
+                "children": [child.node_id for child in node.children],
+            })
+            return level
+
+        write(self.root)
+
+    # Drop the pages of every node of a paged tree that is being replaced
+    def free(self):
+        if self.pager is None:
+            return
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children)
+            self._free(node)
+
+    # Split items into runs of about per_node, rebalancing the last two so none has fewer than min_size
+    # If key is given, avoid cutting between two items with the same key so equal keys stay in one leaf,
+    # unless the run doesn't fit in max_size; lookups follow equal keys into the next leaves
+    @staticmethod
+    def _packed_chunks(items, per_node, min_size, max_size, key=None):
+        def can_cut(position):
+            return key is None or key(items[position - 1]) != key(items[position])
+
+        chunks = []
+        start = 0
+        while start < len(items):
+            end = min(start + per_node, len(items))
+            if end < len(items) and not can_cut(end):
+                # Extend over the run of equal keys if it fits, otherwise stop before it
+                forward = end
+                while forward < len(items) and not can_cut(forward):
+                    forward += 1
+                backward = end
+                while backward > start and not can_cut(backward):
+                    backward -= 1
+                if forward - start <= max_size:
+                    end = forward
+                elif backward > start:
+                    end = backward
+            chunks.append(items[start:end])
+            start = end
+
+        if len(chunks) > 1 and len(chunks[-1]) < min_size:
+            combined = chunks[-2] + chunks[-1]
+            if len(combined) <= max_size:
+                chunks[-2:] = [combined]
+            else:
+                # Split evenly at the closest allowed cut that leaves both halves within max_size
+                cuts = [
+                    i for i in range(len(combined) - max_size, max_size + 1)
+                    if key is None or key(combined[i - 1]) != key(combined[i])
+                ]
+                half = min(cuts or [len(combined) // 2], key=lambda i: abs(i - len(combined) // 2))
+                chunks[-2:] = [combined[:half], combined[half:]]
+        return chunks
 
     # Leaf finding operation
+    # Descends to the leftmost leaf that may hold key, since equal keys can continue into the next leaves
     def find_leaf(self, key):
-        # Go down to a leaf
+        return self._find_leaf_bounded(key)[0]
+
+    # The leaf find_leaf returns, and the separator above it (None for the rightmost leaf).
+    # find_leaf returns the same leaf for every key from key up to that separator.
+    def _find_leaf_bounded(self, key):
         node = self.root
+        upper = None
         while not node.leaf:
-            i = 0
-            while (i < len(node.keys)) and (node.keys[i] <= key):
-                i += 1
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys):
+                upper = node.keys[i]
             node = node.children[i]
-        return node
+        return node, upper
 
     # Search operation
     def search(self, key):
         leaf = self.find_leaf(key)
+        keys, values = leaf.contents()
         result = []
-        # Search the leaf to see if the key exists
-        # return the rid if the key matches
-        for k, r in leaf.keys:
-            if k == key:
-                result.append(r)
-        return result
+        # Gather the rids of the run of matching keys, following the leaf chain while it continues
+        i = bisect_left(keys, key)
+        while True:
+            j = bisect_right(keys, key, i)
+            result.extend(values[i:j])
+            if j < len(keys) or leaf.next is None:
+                return result
+            leaf = leaf.next
+            keys, values = leaf.contents()
+            i = 0
 
     # Insertion operation for inserting into leafs
     def insert(self, key, rid):
-        # check the leaf to insert into and split it if full
+        # Insert in front of any equal keys so the newest rid comes first, and split the leaf if full
         leaf = self.find_leaf(key)
-        i = 0
-        while i < len(leaf.keys) and leaf.keys[i][0] < key:
-            i += 1
-        
-        leaf.keys.insert(i, (key, rid))
-        if len(leaf.keys) > (self.t * 2) - 1:
-            self.split_leaf(leaf)
+        keys, values = leaf.contents(pin=True)
+        i = bisect_left(keys, key)
+        keys.insert(i, key)
+        values.insert(i, rid)
+        leaf.store(keys, values)
+        if len(keys) > (self.t * 2) - 1:
+            # Appending to the rightmost leaf is the common case for increasing keys
+            self.split_leaf(leaf, append=leaf.next is None and i == len(keys) - 1)
+
+    # Insert (key, rid) pairs sorted by key, the result of inserting them one at a time.
+    # Consecutive pairs that land in the same leaf are inserted with one descent, read and store.
+    def insert_run(self, pairs):
+        leaf = None
+        for key, rid in pairs:
+            if leaf is None or (upper is not None and key > upper):
+                if leaf is not None:
+                    leaf.store(keys, values)
+                leaf, upper = self._find_leaf_bounded(key)
+                keys, values = leaf.contents(pin=True)
+            i = bisect_left(keys, key)
+            keys.insert(i, key)
+            values.insert(i, rid)
+            if len(keys) > (self.t * 2) - 1:
+                leaf.store(keys, values)
+                self.split_leaf(leaf, append=leaf.next is None and i == len(keys) - 1)
+                leaf = None
+        if leaf is not None:
+            leaf.store(keys, values)
 
     # Leaf splitting operation for full leafs
-    def split_leaf(self, leaf):
-        # Split the leaf in half into two different leaves
-        new_leaf = BPlusTreeNode(leaf=True)
+    def split_leaf(self, leaf, append=False):
+        # Split the leaf in half, or keep the left leaf full when keys are being appended
+        keys, values = leaf.contents(pin=True)
+        split = len(keys) - 1 if append else len(keys) // 2
+        new_leaf = self._new_node(True, keys[split:], values[split:])
         new_leaf.parent = leaf.parent
-        split = len(leaf.keys) // 2
-        new_leaf.keys = leaf.keys[split:]
-        leaf.keys = leaf.keys[:split]
+        promote_key = keys[split]
+        del keys[split:]
+        del values[split:]
+        leaf.store(keys, values)
 
         # Update the pointers and keep the structure
         new_leaf.next = leaf.next
         leaf.next = new_leaf
-        new_key = new_leaf.keys[0][0]
-        self.insert_in(leaf, new_key, new_leaf)
+        self.insert_in(leaf, promote_key, new_leaf, append)
 
     # Internal node splitting operation
-    def split_internal(self, node):
+    def split_internal(self, node, append=False):
         # Split the internal node into two different nodes and split the children and promote the middle key
-        new_internal = BPlusTreeNode(leaf=False)
+        # When appending, keep the left node as full as possible and move only the last key and children right
+        new_internal = self._new_node(leaf=False)
         new_internal.parent = node.parent
-        split = len(node.keys) // 2
+        split = len(node.keys) - 2 if append else len(node.keys) // 2
         promote_key = node.keys[split]
         new_internal.keys = node.keys[split + 1:]
-        node.keys = node.keys[:split]
         new_internal.children = node.children[split + 1:]
-        node.children = node.children[:split + 1]
+        del node.keys[split:]
+        del node.children[split + 1:]
 
         # Update the pointers and keep the structure
         for child in new_internal.children:
             child.parent = new_internal
 
-        self.insert_in(node, promote_key, new_internal)
+        self.insert_in(node, promote_key, new_internal, append)
 
     # Insertion operation for inserting into an internal node
-    def insert_in(self, node, key, new_node):
+    def insert_in(self, node, key, new_node, append=False):
         # If the node is the root
-        if node == self.root:
+        if node is self.root:
             # Set a new root and add the key into it
-            new_root = BPlusTreeNode(leaf=False)
+            new_root = self._new_node(leaf=False)
             new_root.keys.append(key)
             new_root.children.append(node)
             new_root.children.append(new_node)
@@ -95,72 +372,109 @@ class BPlusTree:
             self.root = new_root
             return
 
-        # Otherwise just insert into the parent and split the parent if it is full
-        i = 0
+        # Otherwise insert next to the node in the parent and split the parent if it is full
         parent = node.parent
-        while i < len(parent.keys) and key > parent.keys[i]:
-            i += 1
+        i = self._child_position(parent, node)
         parent.keys.insert(i, key)
         parent.children.insert(i + 1, new_node)
         new_node.parent = parent
         if len(parent.keys) > (2 * self.t) - 1:
-            self.split_internal(parent)
+            self.split_internal(parent, append and i == len(parent.keys) - 1)
+
+    # Position of a child in its parent, narrowed down with bisect before comparing identities
+    def _child_position(self, parent, child):
+        keys = child.keys
+        if keys:
+            low = bisect_left(parent.keys, keys[0])
+            high = min(bisect_right(parent.keys, keys[0]), len(parent.children) - 1)
+            for i in range(low, high + 1):
+                if parent.children[i] is child:
+                    return i
+        return parent.children.index(child)
 
     # Traverse operation
     def traverse(self, begin=None, end=None):
-        node = self.root
-        # Keep a result for returning
         result = []
+        for values in self.scan(begin, end):
+            result.extend(values)
+        return result
 
+    # Lazy traverse, yields the rids of one leaf at a time so only a leaf is held in memory
+    def scan(self, begin=None, end=None):
         # Search a range if a range is specified and start at the leftmost leaf otherwise
         if begin is not None:
             node = self.find_leaf(begin)
+            keys, values = node.contents()
+            i = bisect_left(keys, begin)
         else:
+            node = self.root
             while not node.leaf:
                 node = node.children[0]
+            keys, values = node.contents()
+            i = 0
 
-        # if the node does not exist, then return
-        if node is None:
-            return result
-
-        # traverse through the linked leafs from left to right bounds and gather the rids
-        while node:
-            for key, rid in node.keys:
-                if begin is not None and key < begin:
-                    continue
-                if end is not None and key > end:
-                    return result
-                result.append(rid)
+        # Walk the linked leafs from left to right bounds
+        while True:
+            if end is not None and keys and keys[-1] > end:
+                yield values[i:bisect_right(keys, end, i)]
+                return
+            if i < len(values):
+                yield values[i:]
+            node = node.next
+            if node is None:
+                return
+            keys, values = node.contents()
+            i = 0
+
+    # Every (key, rid) pair in key order, newest first among equal keys
+    def items(self):
+        node = self.root
+        while not node.leaf:
+            node = node.children[0]
+        while node is not None:
+            keys, values = node.contents()
+            yield from zip(list(keys), list(values))
             node = node.next
-        return result
 
     # Deletion operation
     def delete(self, key, rid):
         leaf = self.find_leaf(key)
+        keys, values = leaf.contents(pin=True)
+        i = bisect_left(keys, key)
 
-        for i, (k, r) in enumerate(leaf.keys):
-            if k == key and r == rid:
-                leaf.keys.pop(i)
-                # Handle root case
-                if leaf == self.root:
-                    if not leaf.keys:
-                        self.root = BPlusTreeNode(leaf=True)
+        # Look for the rid within the run of equal keys, which may continue into the next leaves
+        while True:
+            j = bisect_right(keys, key, i)
+            for position in range(i, j):
+                if values[position] == rid:
+                    del keys[position]
+                    del values[position]
+                    leaf.store(keys, values)
+                    # Handle root case
+                    if leaf is self.root:
+                        return
+                    # Fix underflow if necessary
+                    if len(keys) < self.t:
+                        self.fix_structure(leaf)
                     return
-                # Fix underflow if necessary
-                if len(leaf.keys) < self.t:
-                    self.fix_structure(leaf)
+            leaf.release()
+            if j < len(keys) or leaf.next is None:
                 return
+            leaf = leaf.next
+            keys, values = leaf.contents(pin=True)
+            i = 0
 
     # Restoration function for keeping structure after deletion
     def fix_structure(self, node):
-        if node == self.root:
+        if node is self.root:
             if not node.leaf and len(node.children) == 1:
                 self.root = node.children[0]
                 self.root.parent = None
+                self._free(node)
             return
 
         parent = node.parent
-        index = parent.children.index(node)
+        index = self._child_position(parent, node)
         if index > 0:
             left_sibling = parent.children[index - 1]
         else:
@@ -170,80 +484,278 @@ class BPlusTree:
         else:
             right_sibling = None
 
-        # Borrow from left sibling if possible
-        if left_sibling and len(left_sibling.keys) > self.t:
-            if node.leaf:
-                borrowed = left_sibling.keys.pop(-1)
-                node.keys.insert(0, borrowed)
-                parent.keys[index - 1] = node.keys[0][0]
-            else:
-                borrowed_key = left_sibling.keys.pop(-1)
-                borrowed_child = left_sibling.children.pop(-1)
+        if node.leaf:
+            if not self._fix_leaf(node, parent, index, left_sibling, right_sibling):
+                return
+        else:
+            # Borrow from left sibling if possible
+            if left_sibling and len(left_sibling.keys) > self.t:
+                borrowed_key = left_sibling.keys.pop()
+                borrowed_child = left_sibling.children.pop()
                 node.keys.insert(0, parent.keys[index - 1])
                 node.children.insert(0, borrowed_child)
                 borrowed_child.parent = node
                 parent.keys[index - 1] = borrowed_key
-            return
+                return
 
-        # Borrow from right sibling if possible
-        if right_sibling and len(right_sibling.keys) > self.t:
-            if node.leaf:
-                borrowed = right_sibling.keys.pop(0)
-                node.keys.append(borrowed)
-                parent.keys[index] = right_sibling.keys[0][0] if right_sibling.keys else None
-            else:
+            # Borrow from right sibling if possible
+            if right_sibling and len(right_sibling.keys) > self.t:
                 borrowed_key = right_sibling.keys.pop(0)
                 borrowed_child = right_sibling.children.pop(0)
                 node.keys.append(parent.keys[index])
                 node.children.append(borrowed_child)
                 borrowed_child.parent = node
                 parent.keys[index] = borrowed_key
-            return
+                return
 
-        # Merge with a sibling (prefer left if available)
-        if left_sibling:
-            if node.leaf:
-                left_sibling.keys.extend(node.keys)
-                left_sibling.next = node.next
-            else:
+            # Merge with a sibling (prefer left if available)
+            if left_sibling:
                 left_sibling.keys.append(parent.keys[index - 1])
                 left_sibling.keys.extend(node.keys)
                 left_sibling.children.extend(node.children)
                 for child in node.children:
                     child.parent = left_sibling
-            parent.keys.pop(index - 1)
-            parent.children.pop(index)
-        elif right_sibling:
-            if node.leaf:
-                node.keys.extend(right_sibling.keys)
-                node.next = right_sibling.next
-            else:
+                parent.keys.pop(index - 1)
+                parent.children.pop(index)
+                self._free(node)
+            elif right_sibling:
                 node.keys.append(parent.keys[index])
                 node.keys.extend(right_sibling.keys)
                 node.children.extend(right_sibling.children)
                 for child in right_sibling.children:
                     child.parent = node
+                parent.keys.pop(index)
+                parent.children.pop(index + 1)
+                self._free(right_sibling)
+            else:
+                return
+
+        # Fix parent if necessary
+        if len(parent.keys) < self.t:
+            self.fix_structure(parent)
+
+    # Borrow for or merge an underflowing leaf. Returns True if a merge took a child from the parent.
+    def _fix_leaf(self, node, parent, index, left_sibling, right_sibling):
+        # The three leaves stay pinned until each is stored, released or freed
+        keys, values = node.contents(pin=True)
+        left = left_sibling.contents(pin=True) if left_sibling else None
+        right = right_sibling.contents(pin=True) if right_sibling else None
+
+        # Borrow from left sibling if possible
+        if left and len(left[0]) > self.t:
+            keys.insert(0, left[0].pop())
+            values.insert(0, left[1].pop())
+            left_sibling.store(*left)
+            node.store(keys, values)
+            parent.keys[index - 1] = keys[0]
+            if right:
+                right_sibling.release()
+            return False
+
+        # Borrow from right sibling if possible
+        if right and len(right[0]) > self.t:
+            keys.append(right[0].pop(0))
+            values.append(right[1].pop(0))
+            right_sibling.store(*right)
+            node.store(keys, values)
+            parent.keys[index] = right[0][0]
+            if left:
+                left_sibling.release()
+            return False
+
+        # Merge with a sibling (prefer left if available)
+        if left:
+            left[0].extend(keys)
+            left[1].extend(values)
+            left_sibling.store(*left)
+            left_sibling.next = node.next
+            parent.keys.pop(index - 1)
+            parent.children.pop(index)
+            node.release()
+            self._free(node)
+            if right:
+                right_sibling.release()
+        elif right:
+            keys.extend(right[0])
+            values.extend(right[1])
+            node.store(keys, values)
+            node.next = right_sibling.next
             parent.keys.pop(index)
             parent.children.pop(index + 1)
+            right_sibling.release()
+            self._free(right_sibling)
+        else:
+            node.release()
+            return False
+        return True
+
+# Hash Index Implementation
+# Maps each key to its rids, newest first, for exact-match lookups
+class HashIndex:
+    def __init__(self):
+        self.buckets = {}
+
+    # Build the buckets from (key, rid) pairs given in insertion order
+    @classmethod
+    def build(cls, pairs):
+        index = cls()
+        for key, rid in pairs:
+            index.insert(key, rid)
+        return index
+
+    # Search operation
+    def search(self, key):
+        return list(self.buckets.get(key, ()))
+
+    # Insertion operation, putting the newest rid first like the B+ tree does
+    def insert(self, key, rid):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [rid]
         else:
+            bucket.insert(0, rid)
+
+    # Deletion operation
+    def delete(self, key, rid):
+        bucket = self.buckets.get(key)
+        if bucket is None or rid not in bucket:
             return
+        bucket.remove(rid)
+        if not bucket:
+            del self.buckets[key]
 
-        # Fix parent if necessary
-        if len(parent.keys) < self.t:
-            self.fix_structure(parent)
+    def __contains__(self, key):
+        return key in self.buckets
 
 class Index:
-    def __init__(self, table, t=3):
-        # One index for each table. All are empty initially
+    def __init__(self, table, t=BPLUS_TREE_DEGREE):
+        # One index for each table
+        # The primary key always has a hash index for point lookups and a B-Tree for range queries
         self.table = table
         self.t = t
         self.indices = {}
+        self.primary = HashIndex()
+        self.primary_ready = Event()  # the key column is indexed
+        self.ready = Event()  # every column is indexed
+        self.primary_ready.set()
+        self.ready.set()
+        self.build_error = None  # why the last background build failed, raised by wait_ready
+        self.bufferpool = None
+        self.store = None  # NodeStore of the table once its trees are paged through the bufferpool
+        self.pagers = {}  # column_number -> NodePager
+        self.generation = 0  # number of the last checkpoint of the index file
+        self.loaded = False  # the key column's tree was reloaded from the index file
+        self._build(table.key)
+
+    def attach(self, bufferpool, generation=None):
+        """
+        Page the trees through the bufferpool from now on, in the table's index file.
+        generation is the one the table's last checkpoint saved: if the index file's last checkpoint
+        has it too, the key column's tree saved then is reloaded, otherwise the file is cleared.
+        """
+        self.bufferpool = bufferpool
+        self.store = bufferpool.attach_index(self.table.name, self.t)
+        self.pagers = {}
+        saved = self.store.metadata
+        if saved is not None:
+            self.generation = saved["generation"]
+        if saved is not None and generation == saved["generation"] and saved["key"] == self.table.key:
+            self._load(saved)
+            return
+        for page_id in self.store.page_ids():
+            self.store.delete(page_id)
+        self._build(self.table.key)
+
+    def _load(self, saved):
+        # Only the key column's tree is kept up to date on every change, the others are rebuilt from
+        # the records. Until the hash index is rebuilt from the tree, the tree serves key lookups.
+        key = self.table.key
+        for page_id in self.store.page_ids():
+            if page_id[1] != key:
+                self.store.delete(page_id)
+        pager = self._pager(key)
+        pager.next_id = saved["next_id"]
+        self.indices = {key: BPlusTree.load(self.t, pager, saved["root"])}
+        self.primary = None
+        self.loaded = True
+
+    def save(self):
+        """
+        Write the internal nodes of every tree and checkpoint the index file. Call with the table lock
+        held once its records are written back. Returns the generation of the checkpoint, for the table
+        to save with its own, or None if the trees aren't paged.
+        """
+        if self.store is None:
+            return None
+        self.wait_ready()
+        for tree in self.indices.values():
+            tree.save()
+        self.bufferpool.flush_table(self.table.name)
+        key = self.table.key
+        self.generation += 1
+        self.store.checkpoint({
+            "generation": self.generation,
+            "key": key,
+            "root": self.indices[key].root.node_id,
+            "next_id": self._pager(key).next_id,
+        })
+        return self.generation
+
+    def _pager(self, column_number):
+        if self.store is None:
+            return None
+        pager = self.pagers.get(column_number)
+        if pager is None:
+            pager = self.pagers[column_number] = NodePager(self.bufferpool, self.table.name, column_number)
+        return pager
+
+    # Build the indexes on column_numbers in a background thread, the key column first.
+    # Key lookups wait for the key column, everything else for all of them.
+    def build_in_background(self, column_numbers):
+        column_numbers = sorted(column_numbers, key=lambda column_number: column_number != self.table.key)
+        if self.table.key in column_numbers:
+            self.primary_ready.clear()
+        self.ready.clear()
+        self.build_error = None
+        Thread(target=self._build_all, args=(column_numbers,), daemon=True).start()
+
+    # The events are set even if the build fails, so waiters wake up and wait_ready raises the error
+    def _build_all(self, column_numbers):
+        try:
+            self.build(column_numbers)
+        except Exception as e:
+            self.build_error = e
+        finally:
+            self.primary_ready.set()
+            self.ready.set()
+
+    def build(self, column_numbers):
+        """
+        Build the indexes on column_numbers, and the hash index from a reloaded key column tree.
+        """
+        if self.primary is None:
+            pairs = list(self.indices[self.table.key].items())
+            self.primary = HashIndex.build(reversed(pairs))
+        for column_number in column_numbers:
+            self._build(column_number)
+            if column_number == self.table.key:
+                self.primary_ready.set()
+
+    def wait_ready(self, column_number=None):
+        event = self.primary_ready if column_number == self.table.key else self.ready
+        if not event.is_set():
+            event.wait()
+        if self.build_error is not None:
+            raise Exception(f"Error building the indexes of {self.table.name}: {self.build_error}") from self.build_error
 
     """
     # returns the location of all records with the given value on column "column"
     """
     def locate(self, column_number, column_value):
-        if column_number in self.indices:
+        self.wait_ready(column_number)
+        if column_number == self.table.key and self.primary is not None:
+            return self.primary.search(column_value)
+        elif column_number in self.indices:
             return self.indices[column_number].search(column_value)
         else:
             return [rid for rid, record in self.table.page_directory.items() if record.columns[column_number] == column_value]
@@ -252,35 +764,117 @@ class Index:
     # Returns the RIDs of all records with values in column "column" between "begin" and "end"
     """
     def locate_range(self, start_value, end_value, column_number):
+        self.wait_ready(column_number)
         if column_number in self.indices:
             return self.indices[column_number].traverse(start_value, end_value)
         else:
             return [rid for rid, record in self.table.page_directory.items() if start_value <= record.columns[column_number] <= end_value]
 
 
+    def scan_range(self, start_value, end_value, column_number):
+        """
+        locate_range as a generator of RID batches, one leaf of the column's tree at a time.
+        A column without an index is filtered in one batch.
+        """
+        self.wait_ready(column_number)
+        tree = self.indices.get(column_number)
+        if tree is None:
+            yield self.locate_range(start_value, end_value, column_number)
+            return
+        yield from tree.scan(start_value, end_value)
+
     """
     # optional: Create index on specific column
     """
     def create_index(self, column_number):
-        # Create a B-Tree
-        self.indices[column_number] = BPlusTree(self.t)
-        # Create index for the column
-        for rid, record in self.table.page_directory.items():
-            value = record.columns[column_number]
-            self.indices[column_number].insert(value, rid)
-
-    def insert(self, column_value, rid):
+        self.wait_ready()
+        self._build(column_number)
+
+    def _build(self, column_number):
+        # Build the B-Tree for the column bottom-up from the latest version of every record
+        pairs = self._latest_pairs(column_number)
+        replaced = self.indices.get(column_number)
+        self.indices[column_number] = BPlusTree.bulk_load(self.t, pairs, pager=self._pager(column_number))
+        if replaced is not None:
+            replaced.free()
+        # Rebuild the primary hash index from the same pairs so both stay in step
+        if column_number == self.table.key:
+            self.primary = HashIndex.build(pairs)
+
+    # (value, base rid) of the latest version of every record that isn't deleted.
+    # The page directory also holds the tail records, which an index must not point to.
+    def _latest_pairs(self, column_number):
+        pairs = []
+        for page_range in getattr(self.table, "page_ranges", []):
+            for base_page in page_range.base_pages:
+                rids = []
+                latest = []
+                for rid, indirection in zip(base_page.rid, base_page.indirection):
+                    if rid is None or indirection == ["empty"]:
+                        continue
+                    rids.append(tuple(rid))
+                    latest.append(tuple(indirection) if indirection is not None and indirection[3] == "t" else tuple(rid))
+                # One page at a time, so a lazily opened table reads each stored column once
+                values = self.table.page_directory.column_values(latest, column_number)
+                pairs.extend((value, rid) for rid, value in zip(rids, values) if value is not None)
+        return pairs
+
+    # Index a new record: each column's tree gets that column of the record's columns
+    def insert(self, columns, rid):
+        self.wait_ready()
+        self.primary.insert(columns[self.table.key], rid)
+        for column_number, tree in self.indices.items():
+            if columns[column_number] is not None:
+                tree.insert(columns[column_number], rid)
+
+    # Index many (columns, rid) records, inserting into each tree as one run sorted by its column
+    def insert_many(self, entries):
+        self.wait_ready()
+        for columns, rid in entries:
+            self.primary.insert(columns[self.table.key], rid)
         for column_number, tree in self.indices.items():
-            tree.insert(column_value, rid)
+            pairs = [(columns[column_number], rid) for columns, rid in entries if columns[column_number] is not None]
+            pairs.sort(key=lambda pair: pair[0])
+            tree.insert_run(pairs)
+
+    # Move a record from its old columns to its new ones in the indexes of the columns that changed
+    def update(self, old_columns, new_columns, rid):
+        self.wait_ready()
+        key = self.table.key
+        if old_columns[key] != new_columns[key]:
+            self.primary.delete(old_columns[key], rid)
+            self.primary.insert(new_columns[key], rid)
+        for column_number, tree in self.indices.items():
+            if old_columns[column_number] != new_columns[column_number]:
+                if old_columns[column_number] is not None:
+                    tree.delete(old_columns[column_number], rid)
+                if new_columns[column_number] is not None:
+                    tree.insert(new_columns[column_number], rid)
+
+    # Return the subset of values that already exist in column "column"
+    def existing_values(self, column_number, values):
+        self.wait_ready(column_number)
+        if column_number == self.table.key and self.primary is not None:
+            return {value for value in values if value in self.primary}
+        if column_number in self.indices:
+            tree = self.indices[column_number]
+            return {value for value in values if tree.search(value)}
+        # Without an index, scan the page directory once for the whole batch
+        values = set(values)
+        return {record.columns[column_number] for record in self.table.page_directory.values() if record.columns[column_number] in values}
     """
     # optional: Drop index of specific column
     """
     def drop_index(self, column_number):
+        self.wait_ready()
         if column_number in self.indices:
-            del self.indices[column_number]
+            self.indices.pop(column_number).free()
 
 
-    # Delete a value from the index
-    def delete(self, column_value, rid):
+    # Remove a record from the indexes, given its latest columns. Columns that are None are skipped.
+    def delete(self, columns, rid):
+        self.wait_ready()
+        self.primary.delete(columns[self.table.key], rid)
         for column_number, tree in self.indices.items():
-            tree.delete(column_value, rid)
\ No newline at end of file
+            if columns[column_number] is not None:
+                tree.delete(columns[column_number], rid)
@@ -0,0 +1,260 @@
+import os
+import struct
+import zlib
+import msgpack
+from threading import Lock, Condition
+from lstore.config import GROUP_COMMIT_WINDOW, GROUP_COMMIT_MAX, LOG_SEGMENT_SIZE
+
+
+# Every record is framed as length, crc32 of the payload, LSN, then a msgpack payload
+FRAME = struct.Struct("<IIQ")
+
+
+class LogManager:
+    """
+    Write-ahead log of a database, split into append-only segment files named after the LSN
+    of their first record (wal.log.000000000001, ...).
+    Transactions append an intent record with the key and before-image (undo) of the record a
+    query is about to change, and once it ran a query record holding both the before-image and
+    the after-image (redo), then a commit or abort record. An abort rolls the changes back before
+    its abort record, and logs every rollback the same way, as a compensation record.
+    Only commit forces the log to disk, and the Bufferpool forces it before writing a page back,
+    so no page reaches disk ahead of the log records that describe it.
+
+    Records are binary, length-prefixed and checksummed, and numbered with increasing LSNs.
+    A torn or corrupt tail left by a crash is cut off on open. Checkpoints delete the segments
+    recovery no longer needs.
+
+    Commits use group commit. The first committer to find no fsync running becomes the leader.
+    If other transactions have records in flight, it waits up to GROUP_COMMIT_WINDOW for their
+    commits, then fsyncs once for the whole group. Followers sleep until their LSN is durable.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.next_lsn = 1
+        self.segments = self._list_segments()  # (first LSN, file path), oldest first
+        end = self._recover_end()
+        if not self.segments:
+            self.segments.append((self.next_lsn, self._segment_path(self.next_lsn)))
+        self.file = open(self.segments[-1][1], "ab")
+        self.file.truncate(end)  # drop a torn tail so new records follow the last valid one
+        self.durable_lsn = self.next_lsn - 1  # every record up to this LSN is on disk
+        self.syncing = False  # a leader is running fsync
+        self.in_flight = set()  # transactions with records appended since the last fsync
+        self.pending_commits = 0  # commit records appended since the last fsync
+        self.active = {}  # transaction id -> LSN of its first query record, until it ends
+        self.bytes_appended = 0
+        self.syncs = 0
+        self.commits = 0
+        self.lock = Lock()
+        self.durable = Condition(self.lock)
+
+    def _segment_path(self, first_lsn):
+        return f"{self.path}.{first_lsn:012d}"
+
+    def _list_segments(self):
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        segments = []
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                suffix = name[len(prefix):]
+                if name.startswith(prefix) and suffix.isdigit():
+                    segments.append((int(suffix), os.path.join(directory, name)))
+        return sorted(segments)
+
+    def _recover_end(self):
+        # Continue numbering after the last valid record and return where it ends in the last segment.
+        # A torn or corrupt frame ends the log, so every segment after it is dropped.
+        end = 0
+        for index, (first_lsn, path) in enumerate(self.segments):
+            self.next_lsn = max(self.next_lsn, first_lsn)
+            with open(path, "rb") as f:
+                data = f.read()
+            end = 0
+            for lsn, _, end in _frames(data):
+                self.next_lsn = lsn + 1
+            if end < len(data):
+                for _, later in self.segments[index + 1:]:
+                    os.remove(later)
+                self.segments = self.segments[:index + 1]
+                break
+        return end
+
+    def append(self, record):
+        """
+        Buffered append, durable only after the next flush. Returns the record's LSN.
+        """
+        payload = msgpack.packb(record, use_bin_type=True)
+        with self.lock:
+            lsn = self.next_lsn
+            self.next_lsn += 1
+            self.file.write(FRAME.pack(len(payload), zlib.crc32(payload), lsn))
+            self.file.write(payload)
+            self.bytes_appended += FRAME.size + len(payload)
+            if "txn" in record:
+                self.in_flight.add(record["txn"])
+                if record["type"] in ("intent", "query"):
+                    self.active.setdefault(record["txn"], lsn)
+            if self.file.tell() >= LOG_SEGMENT_SIZE:
+                self._rotate()
+            return lsn
+
+    def _rotate(self):
+        # Start a new segment. The full one is synced first, so only the last segment can be torn.
+        while self.syncing:
+            self.durable.wait()
+        if self.file.tell() < LOG_SEGMENT_SIZE:
+            return  # another appender rotated while this one waited
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.segments.append((self.next_lsn, self._segment_path(self.next_lsn)))
+        self.file = open(self.segments[-1][1], "ab")
+        self.durable_lsn = self.next_lsn - 1
+        self.in_flight.clear()
+        self.pending_commits = 0
+        self.durable.notify_all()
+
+    def log_intent(self, transaction_id, table_name, key, before, compensation=False):
+        # Appended before the query changes anything, so none of its pages reach disk ahead of the log
+        return self.append({
+            "type": "intent",
+            "txn": transaction_id,
+            "table": table_name,
+            "key": key,
+            "undo": before,
+            "clr": compensation,
+        })
+
+    def log_query(self, transaction_id, table_name, key, before, after, compensation=False):
+        # before is None for an insert and after is None for a delete.
+        # A compensation record logs the rollback of an earlier change, and is never undone itself.
+        return self.append({
+            "type": "query",
+            "txn": transaction_id,
+            "table": table_name,
+            "key": key,
+            "undo": before,
+            "redo": after,
+            "clr": compensation,
+        })
+
+    def commit(self, transaction_id):
+        # Returns once the commit record is durable
+        lsn = self.append({"type": "commit", "txn": transaction_id})
+        with self.lock:
+            self.active.pop(transaction_id, None)
+            self.pending_commits += 1
+            self.commits += 1
+            self.durable.notify_all()  # a leader may be waiting for this commit
+        self.flush(lsn, group=True)
+        return lsn
+
+    def abort(self, transaction_id):
+        # Aborted changes are already rolled back in memory, so this doesn't need to be forced
+        lsn = self.append({"type": "abort", "txn": transaction_id})
+        with self.lock:
+            # A leader shouldn't wait for a commit that will never come
+            self.in_flight.discard(transaction_id)
+            self.active.pop(transaction_id, None)
+            self.durable.notify_all()
+        return lsn
+
+    def flush(self, lsn=None, group=False):
+        """
+        Make every record up to lsn (default: all of them) durable.
+        With group=True the leader waits for other in-flight transactions to commit first.
+        """
+        with self.lock:
+            target = self.next_lsn - 1 if lsn is None else lsn
+            while self.durable_lsn < target:
+                if self.syncing:
+                    # Follower: the running fsync or the next one covers this LSN
+                    self.durable.wait()
+                    continue
+
+                # Leader: gather the commits of the other in-flight transactions
+                self.syncing = True
+                if group and len(self.in_flight) > 1:
+                    self.durable.wait_for(
+                        lambda: self.pending_commits >= min(len(self.in_flight), GROUP_COMMIT_MAX),
+                        GROUP_COMMIT_WINDOW,
+                    )
+                end = self.next_lsn - 1
+                self.file.flush()
+                self.in_flight.clear()
+                self.pending_commits = 0
+
+                # fsync without the lock so new records keep being appended meanwhile
+                self.lock.release()
+                try:
+                    os.fsync(self.file.fileno())
+                finally:
+                    self.lock.acquire()
+                    self.syncing = False
+                self.durable_lsn = end
+                self.syncs += 1
+                self.durable.notify_all()
+
+    def active_transactions(self):
+        """
+        Returns {transaction id: LSN of its first query record} for the transactions still running.
+        """
+        with self.lock:
+            return dict(self.active)
+
+    def records(self):
+        """
+        Every record in the log, oldest first, with its LSN under "lsn".
+        """
+        self.flush()
+        with self.lock:
+            segments = list(self.segments)
+        for _, path in segments:
+            with open(path, "rb") as f:
+                data = f.read()
+            for lsn, payload, _ in _frames(data):
+                record = msgpack.unpackb(payload, raw=False)
+                record["lsn"] = lsn
+                yield record
+
+    def truncate_before(self, lsn):
+        # Delete the segments holding only records older than lsn. The current segment always stays.
+        with self.lock:
+            while len(self.segments) > 1 and self.segments[1][0] <= lsn:
+                os.remove(self.segments.pop(0)[1])
+
+    def truncate(self):
+        # Drop every record, once the pages and page directory they describe are on disk.
+        # LSNs keep counting up, the new segment is named after the next one.
+        with self.lock:
+            while self.syncing:
+                self.durable.wait()
+            self.file.close()
+            for _, path in self.segments:
+                os.remove(path)
+            self.segments = [(self.next_lsn, self._segment_path(self.next_lsn))]
+            self.file = open(self.segments[-1][1], "ab")
+            self.durable_lsn = self.next_lsn - 1
+            self.in_flight.clear()
+            self.active.clear()
+            self.pending_commits = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def _frames(data):
+    # Yields (lsn, payload, end offset) for every valid record, stopping at the first bad frame
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        length, crc, lsn = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset = start + length
+        yield lsn, payload, offset
@@ -0,0 +1,119 @@
+from threading import Condition, Lock, Thread, current_thread
+from lstore.config import MERGE_THRESHOLD, MERGE_WORKERS, MERGE_THROTTLE_RATIO, MERGE_BACKOFF, MERGE_MAX_BACKOFF
+
+
+class MergeScheduler:
+    """
+    Runs the merges of a database's tables on a pool of at most MERGE_WORKERS threads.
+    Every update reports the page range it appended a tail record to. A range becomes a candidate
+    once MERGE_THRESHOLD tail records were appended since its last merge, and a free worker takes
+    the candidate with the most. A range is queued or merged at most once at a time, updates in
+    the meantime only raise its count.
+
+    Updates also report how long they took. While the recent average is MERGE_THROTTLE_RATIO
+    times the long-run one, a worker backs off MERGE_BACKOFF seconds at a time before starting a
+    merge, up to MERGE_MAX_BACKOFF, so merges yield to foreground queries without starving.
+    """
+
+    def __init__(self, num_workers=MERGE_WORKERS):
+        self.num_workers = num_workers
+        self.workers = []
+        self.pressure = {}  # (table, page range number) -> tail records since its last merge
+        self.queued = set()  # candidates waiting for a worker
+        self.running = set()  # candidates being merged
+        self.recent_latency = None  # fast moving average of update latency, in seconds
+        self.baseline_latency = None  # slow moving average of the same
+        self.stopping = False
+        self.merges = 0
+        self.backoffs = 0
+        self.lock = Lock()
+        self.work = Condition(self.lock)
+
+    def note_update(self, table, page_range_index, seconds):
+        """
+        Count a tail record appended to a page range by an update that took seconds.
+        """
+        with self.lock:
+            if self.recent_latency is None:
+                self.recent_latency = self.baseline_latency = seconds
+            else:
+                self.recent_latency += (seconds - self.recent_latency) * 0.05
+                self.baseline_latency += (seconds - self.baseline_latency) * 0.001
+            key = (table, page_range_index)
+            self.pressure[key] = self.pressure.get(key, 0) + 1
+            self._queue(key)
+
+    def _queue(self, key):
+        # Make the range a candidate if it is due and not already queued or merging. Call with the lock held.
+        if self.stopping or self.pressure.get(key, 0) < MERGE_THRESHOLD:
+            return
+        if key in self.queued or key in self.running:
+            return
+        self.queued.add(key)
+        if len(self.workers) < self.num_workers:
+            worker = Thread(target=self._work, daemon=True)
+            self.workers.append(worker)
+            worker.start()
+        self.work.notify_all()
+
+    def _overloaded(self):
+        return self.recent_latency is not None and self.recent_latency > self.baseline_latency * MERGE_THROTTLE_RATIO
+
+    def _work(self):
+        # Worker loop: merge the hottest candidate, backing off first while updates are slow
+        while True:
+            with self.lock:
+                while not self.stopping and not self.queued:
+                    self.work.wait()
+                if self.stopping:
+                    return
+                key = max(self.queued, key=self.pressure.__getitem__)
+                self.queued.discard(key)
+                self.running.add(key)
+
+                waited = 0.0
+                while not self.stopping and waited < MERGE_MAX_BACKOFF and self._overloaded():
+                    self.backoffs += 1
+                    self.work.wait(MERGE_BACKOFF)
+                    waited += MERGE_BACKOFF
+                # Tail records appended from here on may miss the merge's snapshot, so they still count
+                merged = self.pressure.get(key)  # None if the table was forgotten meanwhile
+
+            table, page_range_index = key
+            try:
+                if merged is not None and not self.stopping:
+                    table.merge_page_range(table.page_ranges[page_range_index])
+            except Exception as e:
+                print(f"Merge of page range {page_range_index} of {table.name} failed: {e}")
+
+            with self.lock:
+                self.running.discard(key)
+                if merged is not None and key in self.pressure:
+                    self.merges += 1
+                    self.pressure[key] -= merged
+                    self._queue(key)
+                self.work.notify_all()  # stop() and forget() wait for running merges
+
+    def forget(self, table):
+        """
+        Drop the pending merges of a table, waiting for one that is running.
+        """
+        with self.lock:
+            for key in [key for key in self.pressure if key[0] is table]:
+                self.pressure.pop(key)
+                self.queued.discard(key)
+            while any(key[0] is table for key in self.running):
+                self.work.wait()
+
+    def stop(self):
+        """
+        Drop the pending merges and wait for the running ones to finish.
+        """
+        with self.lock:
+            self.stopping = True
+            self.queued.clear()
+            self.work.notify_all()
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            if worker is not current_thread():
+                worker.join()
@@ -1,45 +1,84 @@
+from array import array
 from lstore.config import PAGE_SIZE, RECORDS_PER_PAGE
 
+# Range of the values a LogicalPage holds: signed 64-bit integers.
+# The page store writes None as INT64_MIN, so that value reads back as None once a page is stored.
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
 class LogicalPage:
     def __init__(self):
         self.num_records = 0
         self.data = bytearray(PAGE_SIZE)
+        # Native-endian int64 view over the data so whole columns can be read or written in one call
+        self.values = memoryview(self.data).cast("q")
 
     def has_capacity(self):
         return self.num_records < RECORDS_PER_PAGE
 
     def write(self, value):
-        # Only handle 8-byte integers for milestone 1
+        # Only handle 8-byte signed integers
         if not isinstance(value, int):
             raise ValueError("Value must be an integer")
-        if value.bit_length() > 64:
-            raise OverflowError("int too big to convert")
-        
-        # Convert the integer to a bytearray
-        value_bytes = value.to_bytes(8, byteorder='big')
-        
-        # Get the start and end index of the value in the data bytearray
-        start = self.num_records * 8
-        end = (self.num_records + 1) * 8
-        
-        # Write the value to the data bytearray
-        self.data[start:end] = value_bytes
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise OverflowError("Value must fit in a signed 64-bit integer")
+
+        # Write the value straight into the next slot of the typed view
+        self.values[self.num_records] = value
         self.num_records += 1
 
+    def write_many(self, values):
+        # Write a run of values in a single slice assignment, array raises OverflowError outside the int64 range
+        values = array("q", values)
+        end = self.num_records + len(values)
+        if end > RECORDS_PER_PAGE:
+            raise IndexError("Not enough capacity in the page")
+        self.values[self.num_records:end] = values
+        self.num_records = end
+        return len(values)
+
     def read(self, index, num_values):
-        values = []
-        
-        # Read the values from the data bytearray and append them to the list
-        for i in range(num_values):
-            start = (index + i) * 8
-            end = (index + i + 1) * 8
-            value_bytes = self.data[start:end]
-            value = int.from_bytes(value_bytes, byteorder='big')
-            values.append(value)
-        return values
+        # Decode the whole run at once instead of one value at a time
+        return self.values[index:index + num_values].tolist()
+
+    def column(self, start=0, stop=None):
+        # Zero-copy view over the written values, or a slice of them
+        if stop is None or stop > self.num_records:
+            stop = self.num_records
+        return self.values[start:stop]
+
+# Page fields a lazily opened table fills in from the stored page on first access
+LAZY_FIELDS = ("rid", "num_records", "indirection", "schema_encoding", "start_time", "pages", "tps")
+
+class LazyPage:
+    """
+    Lets a page of a lazily opened table be created without its metadata.
+    unloaded() returns a page whose fields are missing until one of them is first read,
+    then loader(page) fills them all in and clears page.loader.
+    """
+    loader = None
+
+    @classmethod
+    def unloaded(cls, num_cols, loader):
+        page = cls.__new__(cls)
+        page.num_cols = num_cols
+        page.loader = loader
+        return page
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, so a loaded page pays nothing for this
+        if name not in LAZY_FIELDS:
+            raise AttributeError(name)
+        loader = self.loader
+        if loader is not None:
+            loader(self)
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
 # compressed, read-only pages
-class BasePage:
+class BasePage(LazyPage):
     def __init__(self, num_cols):
         # Initialize the page 
         # Records are logically alligned
@@ -82,7 +121,7 @@ class BasePage:
         
 
 # uncompressed, append-only updates
-class TailPage:
+class TailPage(LazyPage):
     def __init__(self, num_cols):
         # Initialize the page 
         # Records are logically alligned
@@ -0,0 +1,595 @@
+import os
+import mmap
+import struct
+import zlib
+import heapq
+import msgpack
+from abc import ABC, abstractmethod
+from array import array
+from threading import Lock
+from lstore.config import PAGE_SIZE, RECORDS_PER_PAGE
+
+
+MAGIC = b"LSTOREPG"
+NULL = -(2 ** 63)  # stands in for None in every integer field
+PAGE_KINDS = ("free", "base", "tail")  # page kind code -> page_id[0]
+RID_KINDS = (None, "b", "t", "empty")  # rid kind code -> rid[3]
+
+# magic, page kind, page range, page index, tps, num_columns
+HEADER = struct.Struct("<8sqqqqq")
+METADATA_FIELDS = ("rid", "indirection", "timestamp", "schema_encoding")  # header order, after the columns
+UNREAD = object()  # placeholder for a column of a StoredPage that wasn't read yet
+# magic, level, number of keys, number of rids or children of a B+ tree node
+NODE_MAGIC = b"LSTORENO"
+NODE_HEADER = struct.Struct("<8sqqq")
+# length and crc32 of one msgpack chunk of rids deleted from the page directory
+DIRECTORY_FRAME = struct.Struct("<II")
+
+
+class SlotStore(ABC):
+    """
+    A file of fixed-size slots, one page per slot, addressed by page id.
+
+    Slots use shadow paging. The slot map saved by the last checkpoint() (in a .map file next to
+    the segment) is the durable one, and its slots are never overwritten: the first write of a
+    page after a checkpoint goes to a fresh slot. Opening the store after a crash therefore sees
+    exactly the pages of the last checkpoint, which recovery then brings forward from the log.
+    Freed slots are handed out again before the file grows.
+
+    Subclasses set slot_size and layout (saved in the map and checked on open) and implement
+    encode and decode.
+    """
+
+    def __init__(self, path, slot_size, layout):
+        self.path = path
+        self.slot_size = slot_size
+        self.read_size = slot_size  # bytes read() loads from disk
+        self.layout = layout
+        self.map_path = os.path.splitext(path)[0] + ".map"
+        self.slots = {}  # page_id -> slot number, including writes since the last checkpoint
+        self.durable = {}  # page_id -> slot number as of the last checkpoint
+        self.metadata = None  # whatever the owner saved with the last checkpoint
+        self.free = []  # heap of free slot numbers
+        self.writing = set()  # slots allocated to writes that aren't published yet
+        self.num_slots = 0
+        self.map = None  # read-only mmap of the file, remapped when it grows
+        self.lock = Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._load_slot_map()
+
+    def _load_slot_map(self):
+        # Slots written after the last checkpoint are not in the map and are free again
+        self.num_slots = os.fstat(self.fd).st_size // self.slot_size
+        if os.path.exists(self.map_path):
+            with open(self.map_path, "rb") as f:
+                saved = msgpack.unpackb(f.read(), raw=False)
+            for name, value in self.layout.items():
+                if saved.get(name) != value:
+                    raise ValueError(f"{self.path} holds {name} {saved.get(name)}, expected {value}")
+            for kind, first, second, slot in saved["slots"]:
+                self.durable[(kind, first, second)] = slot
+            self.metadata = saved.get("metadata")
+            self._load_fields(saved)
+        self.slots = dict(self.durable)
+        self._rebuild_free()
+
+    def _load_fields(self, saved):
+        # Subclasses read what they saved next to the slot map
+        pass
+
+    def _rebuild_free(self):
+        used = set(self.slots.values()) | self.writing
+        self.free = [slot for slot in range(self.num_slots) if slot not in used]
+        heapq.heapify(self.free)
+
+    def checkpoint(self, metadata=None):
+        """
+        Make the current pages durable: sync the file, then atomically replace the slot map.
+        metadata is saved in the same map file, so it always matches the checkpointed pages.
+        Slots only the old map referenced become free.
+        """
+        with self.lock:
+            os.fsync(self.fd)
+            self._replace_map(metadata)
+
+    def _replace_map(self, metadata, **fields):
+        # Call with the lock held, once the file is synced
+        saved = {
+            **self.layout,
+            "slots": [[*page_id, slot] for page_id, slot in self.slots.items()],
+            "metadata": metadata,
+            **fields,
+        }
+        tmp_path = self.map_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(msgpack.packb(saved, use_bin_type=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.map_path)
+        self.metadata = metadata
+        self.durable = dict(self.slots)
+        self._rebuild_free()
+
+    def __contains__(self, page_id):
+        return page_id in self.slots
+
+    def page_ids(self):
+        return list(self.slots)
+
+    def read(self, page_id):
+        """
+        Returns the page dict stored for page_id, or None if the page was never written.
+        """
+        slot = self.slots.get(page_id)
+        if slot is None:
+            return None
+        raw = os.pread(self.fd, self.slot_size, slot * self.slot_size)
+        return self.decode(raw)
+
+    def _mapping(self, slot):
+        with self.lock:
+            end = (slot + 1) * self.slot_size
+            if self.map is None or len(self.map) < end:
+                # The old map stays valid for views that still reference it
+                self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            return self.map
+
+    def write(self, page_id, page_data):
+        slot = self._slot_for_write(page_id)
+        os.pwrite(self.fd, self.encode(page_id, page_data), slot * self.slot_size)
+        self._publish(page_id, slot)
+
+    def _slot_for_write(self, page_id):
+        # The slot a write of page_id goes to. A new one isn't published until _publish(), so
+        # readers keep using the old slot until the new one holds the whole page.
+        with self.lock:
+            slot = self.slots.get(page_id)
+            if slot is None or slot == self.durable.get(page_id):
+                # Never overwrite the checkpointed copy, it's what a crash falls back to
+                slot = self._allocate()
+                self.writing.add(slot)
+            return slot
+
+    def _publish(self, page_id, slot):
+        with self.lock:
+            self.writing.discard(slot)
+            self.slots[page_id] = slot
+
+    def delete(self, page_id):
+        # A checkpointed slot stays taken until the next checkpoint
+        with self.lock:
+            slot = self.slots.pop(page_id, None)
+            if slot is not None and slot != self.durable.get(page_id):
+                heapq.heappush(self.free, slot)
+
+    def _allocate(self):
+        if self.free:
+            return heapq.heappop(self.free)
+        self.num_slots += 1
+        return self.num_slots - 1
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # a caller still holds a column view, the map closes when it is released
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    @abstractmethod
+    def encode(self, page_id, page_data):
+        # The slot bytes of a page
+        pass
+
+    @abstractmethod
+    def decode(self, raw):
+        # The page stored in a slot's bytes
+        pass
+
+    @staticmethod
+    def _put(buf, offset, values):
+        data = values.tobytes()
+        buf[offset:offset + len(data)] = data
+
+    @staticmethod
+    def _get(raw, offset, count):
+        values = array("q")
+        values.frombytes(raw[offset:offset + count * 8])
+        return values
+
+
+class PageStore(SlotStore):
+    """
+    Stores every base and tail page of one table in a single segment file.
+    Each slot is aligned to PAGE_SIZE and laid out as:
+
+        block 0                 header, then the length of every field below
+        blocks 1 .. C           one block of int64 values per column
+        blocks C+1 .. C+4       rid as (kind, page range, page, slot) words
+        blocks C+5 .. C+8       indirection, encoded like rid
+        block C+9               timestamp
+        block C+10              schema encoding as a bitmask
+
+    Each block holds RECORDS_PER_PAGE int64 words, so every column and metadata field is a unit of
+    its own on disk. read() only reads the header and returns a StoredPage, which reads a field
+    from its blocks the first time it is used, so a page loaded for one column never decodes the
+    others. A write-back in place only writes the header and the fields that were read. column()
+    reads through a read-only memory map of the file instead, so cold reads are served by the OS
+    page cache without loading the page at all.
+
+    The table's page directory is rebuilt from the pages, so only the rids deleted from it are
+    saved, in a directory file next to the segment. A checkpoint appends the rids deleted since
+    the previous one after the length the slot map recorded, then records the new length.
+    """
+
+    def __init__(self, path, num_columns):
+        if HEADER.size + 8 * (num_columns + 4) > PAGE_SIZE:
+            raise ValueError(f"Too many columns for a page header: {num_columns}")
+        self.num_columns = num_columns
+        self.directory_path = os.path.join(os.path.dirname(path), "directory.del")
+        self.directory_length = 0  # bytes of the directory file the last checkpoint covers
+        super().__init__(path, (num_columns + 11) * PAGE_SIZE, {"num_columns": num_columns})
+        self.read_size = HEADER.size + 8 * (num_columns + 4)
+
+    def _load_fields(self, saved):
+        self.directory_length = saved.get("directory_length", 0)
+
+    def checkpoint(self, metadata=None, deleted_rids=()):
+        """
+        Make the current pages durable: sync the segment, then atomically replace the slot map.
+        metadata is saved in the same map file, so it always matches the checkpointed pages,
+        and so are the rids deleted from the page directory since the last checkpoint.
+        Slots only the old map referenced become free.
+        """
+        with self.lock:
+            os.fsync(self.fd)
+            directory_length = self.directory_length
+            if deleted_rids:
+                directory_length = self._write_deleted(deleted_rids)
+            self._replace_map(metadata, directory_length=directory_length)
+            self.directory_length = directory_length
+
+    def _write_deleted(self, rids):
+        # Append a chunk after the checkpointed part of the directory file and return the new length
+        # once it is on disk. Anything past that length was left by a checkpoint that didn't finish.
+        chunk = msgpack.packb(list(rids), use_bin_type=True)
+        with open(self.directory_path, "r+b" if self.directory_length else "wb") as f:
+            f.seek(self.directory_length)
+            f.write(DIRECTORY_FRAME.pack(len(chunk), zlib.crc32(chunk)))
+            f.write(chunk)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        return self.directory_length + DIRECTORY_FRAME.size + len(chunk)
+
+    def read_deleted(self):
+        """
+        Returns the set of rids deleted from the page directory as of the last checkpoint.
+        """
+        deleted = set()
+        if not self.directory_length:
+            return deleted
+        with open(self.directory_path, "rb") as f:
+            data = f.read(self.directory_length)
+        offset = 0
+        while offset < len(data):
+            length, crc = DIRECTORY_FRAME.unpack_from(data, offset)
+            start = offset + DIRECTORY_FRAME.size
+            chunk = data[start:start + length]
+            if len(chunk) < length or zlib.crc32(chunk) != crc:
+                raise ValueError(f"Corrupt page directory chunk in {self.directory_path} at {offset}")
+            deleted.update(tuple(rid) for rid in msgpack.unpackb(chunk, raw=False))
+            offset = start + length
+        return deleted
+
+    def column(self, page_id, column):
+        """
+        Returns a zero-copy int64 memoryview of one column of a stored page, or None if the page
+        was never written. None values read back as NULL.
+        """
+        slot = self.slots.get(page_id)
+        if slot is None:
+            return None
+        mapping = self._mapping(slot)
+        offset = slot * self.slot_size
+        if len(mapping) < offset + self.slot_size:
+            return None  # the slot is allocated but its first write hasn't landed yet
+        count = struct.unpack_from("q", mapping, offset + HEADER.size + 8 * column)[0]
+        start = offset + (column + 1) * PAGE_SIZE
+        return memoryview(mapping)[start:start + count * 8].cast("q")
+
+    def read(self, page_id):
+        """
+        Returns a StoredPage for page_id, or None if the page was never written.
+        Only the header is read here.
+        """
+        slot = self.slots.get(page_id)
+        if slot is None:
+            return None
+        header = os.pread(self.fd, self.read_size, slot * self.slot_size)
+        _, _, _, _, tps, _ = HEADER.unpack_from(header, 0)
+        counts = self._get(header, HEADER.size, self.num_columns + 4).tolist()
+        return StoredPage(self, slot, counts, None if tps == NULL else tps)
+
+    def read_field(self, slot, field, count):
+        # Read and decode count values of a column number or metadata field from its blocks
+        offset, width = self._field_layout(field)
+        raw = os.pread(self.fd, 8 * width * count, slot * self.slot_size + offset)
+        return self._decode_field(field, self._get(raw, 0, width * count))
+
+    def write(self, page_id, page_data):
+        slot = self._slot_for_write(page_id)
+        if isinstance(page_data, StoredPage):
+            if page_data.slot == slot:
+                self._write_read_fields(page_id, page_data)
+                return
+            # A fresh slot needs every field, so read the rest from the slot the page came from
+            page_data.read_all()
+        os.pwrite(self.fd, self.encode(page_id, page_data), slot * self.slot_size)
+        self._publish(page_id, slot)
+        if isinstance(page_data, StoredPage):
+            page_data.slot = slot
+
+    def _write_read_fields(self, page_id, page):
+        # Rewrite the header and the fields that were read in place, the others are unchanged on disk
+        fields = page.read_fields()
+        counts = list(page.counts)
+        for field, values in fields.items():
+            if len(values) > RECORDS_PER_PAGE:
+                raise ValueError(f"Page {page_id} holds more than {RECORDS_PER_PAGE} records")
+            counts[self._count_index(field)] = len(values)
+        start = page.slot * self.slot_size
+        os.pwrite(self.fd, self._header(page_id, page.get("tps"), counts), start)
+        for field, values in fields.items():
+            offset, _ = self._field_layout(field)
+            os.pwrite(self.fd, self._encode_field(field, values).tobytes(), start + offset)
+        page.counts = counts
+
+    def _field_layout(self, field):
+        # (offset in the slot, words per value) of a column number or metadata field
+        if isinstance(field, int):
+            return (field + 1) * PAGE_SIZE, 1
+        block = {"rid": 1, "indirection": 5, "timestamp": 9, "schema_encoding": 10}[field]
+        return (self.num_columns + block) * PAGE_SIZE, 4 if field in ("rid", "indirection") else 1
+
+    def _count_index(self, field):
+        # Position of the field's length in the header
+        return field if isinstance(field, int) else self.num_columns + METADATA_FIELDS.index(field)
+
+    def _header(self, page_id, tps, counts):
+        header = HEADER.pack(
+            MAGIC, PAGE_KINDS.index(page_id[0]), page_id[1], page_id[2],
+            NULL if tps is None else tps, self.num_columns,
+        )
+        return header + array("q", counts).tobytes()
+
+    def _encode_field(self, field, values):
+        if isinstance(field, int):
+            return _encode_ints(values)
+        if field in ("rid", "indirection"):
+            return _encode_rids(values)
+        if field == "timestamp":
+            return array("q", [_encode_timestamp(v) for v in values])
+        return array("q", [_encode_schema(v) for v in values])
+
+    def _decode_field(self, field, words):
+        if isinstance(field, int):
+            return _decode_ints(words)
+        if field in ("rid", "indirection"):
+            return _decode_rids(words)
+        if field == "timestamp":
+            return [None if v == NULL else str(v) for v in words]
+        width = f"0{self.num_columns}b"
+        return [None if v == NULL else format(v, width) for v in words]
+
+    def encode(self, page_id, page_data):
+        """
+        Packs a page dict into the slot layout. Raises ValueError if a field does not fit.
+        """
+        columns = page_data.get("columns") or []
+        if len(columns) > self.num_columns:
+            raise ValueError(f"Page {page_id} has {len(columns)} columns, expected {self.num_columns}")
+        fields = dict(enumerate(list(columns) + [[]] * (self.num_columns - len(columns))))
+        for field in METADATA_FIELDS:
+            fields[field] = page_data.get(field) or []
+        for values in fields.values():
+            if len(values) > RECORDS_PER_PAGE:
+                raise ValueError(f"Page {page_id} holds more than {RECORDS_PER_PAGE} records")
+
+        buf = bytearray(self.slot_size)
+        header = self._header(page_id, page_data.get("tps"), [len(values) for values in fields.values()])
+        buf[:len(header)] = header
+        for field, values in fields.items():
+            offset, _ = self._field_layout(field)
+            self._put(buf, offset, self._encode_field(field, values))
+        return buf
+
+    def decode(self, raw):
+        counts = self._get(raw, HEADER.size, self.num_columns + 4)
+        _, _, _, _, tps, _ = HEADER.unpack_from(raw, 0)
+        page_data = {"tps": None if tps == NULL else tps}
+        fields = {}
+        for field in [*range(self.num_columns), *METADATA_FIELDS]:
+            offset, width = self._field_layout(field)
+            fields[field] = self._decode_field(field, self._get(raw, offset, width * counts[self._count_index(field)]))
+        page_data["columns"] = [fields[column] for column in range(self.num_columns)]
+        for field in METADATA_FIELDS:
+            page_data[field] = fields[field]
+        return page_data
+
+
+class StoredPage(dict):
+    """
+    Page dict read from a PageStore one field at a time. The columns and the metadata fields are
+    read from their own blocks the first time they are used, from the slot the page was read from,
+    which stays allocated until a write-back moves the page after reading every field.
+    """
+
+    def __init__(self, store, slot, counts, tps):
+        super().__init__(tps=tps)
+        self.store = store
+        self.slot = slot
+        self.counts = counts  # stored length of every field, in header order
+        self.lock = Lock()
+        dict.__setitem__(self, "columns", StoredColumns(self, store.num_columns))
+
+    def __missing__(self, field):
+        if field not in METADATA_FIELDS:
+            raise KeyError(field)
+        with self.lock:
+            if not dict.__contains__(self, field):
+                count = self.counts[self.store.num_columns + METADATA_FIELDS.index(field)]
+                dict.__setitem__(self, field, self.store.read_field(self.slot, field, count))
+            return dict.__getitem__(self, field)
+
+    def __contains__(self, field):
+        return field in METADATA_FIELDS or dict.__contains__(self, field)
+
+    def get(self, field, default=None):
+        return self[field] if field in self else default
+
+    def read_all(self):
+        for field in METADATA_FIELDS:
+            self[field]
+        for _ in self["columns"]:
+            pass
+
+    def read_fields(self):
+        """
+        Returns {column number or field name: values} for every field read so far.
+        """
+        columns = dict.__getitem__(self, "columns")
+        fields = dict(columns.read_columns() if isinstance(columns, StoredColumns) else enumerate(columns))
+        for field in METADATA_FIELDS:
+            if dict.__contains__(self, field):
+                fields[field] = dict.__getitem__(self, field)
+        return fields
+
+
+class StoredColumns(list):
+    """
+    Columns of a StoredPage, each read from its block on first access.
+    """
+
+    def __init__(self, page, num_columns):
+        super().__init__([UNREAD] * num_columns)
+        self.page = page
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        values = super().__getitem__(index)
+        if values is UNREAD:
+            index %= len(self)
+            with self.page.lock:
+                values = super().__getitem__(index)
+                if values is UNREAD:
+                    values = self.page.store.read_field(self.page.slot, index, self.page.counts[index])
+                    super().__setitem__(index, values)
+        return values
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def read_columns(self):
+        return [(index, values) for index, values in enumerate(list.__iter__(self)) if values is not UNREAD]
+
+
+class NodeStore(SlotStore):
+    """
+    Stores the B+ tree nodes of one table's indexes, one node per slot, under page ids
+    ("node", column, node id). A slot is a header followed by the keys, then either the rids of
+    a leaf (as rid words) or the child node ids of an internal node:
+
+        magic, level (0 for a leaf), number of keys, number of rids or children
+
+    Slots fit 2 * degree keys and links, so a leaf fits even while it waits to be split.
+    """
+
+    def __init__(self, path, degree):
+        self.degree = degree
+        size = NODE_HEADER.size + 2 * degree * 8 * 5
+        super().__init__(path, -(-size // PAGE_SIZE) * PAGE_SIZE, {"degree": degree})
+
+    def encode(self, page_id, page_data):
+        """
+        Packs a node dict into a slot. Raises ValueError if the node does not fit.
+        """
+        keys = page_data["keys"]
+        level = page_data["level"]
+        links = _encode_rids(page_data["values"]) if level == 0 else array("q", page_data["children"])
+        count = len(links) // 4 if level == 0 else len(links)
+        if len(keys) > 2 * self.degree or count > 2 * self.degree:
+            raise ValueError(f"Node {page_id} holds more than {2 * self.degree} keys")
+        buf = bytearray(self.slot_size)
+        NODE_HEADER.pack_into(buf, 0, NODE_MAGIC, level, len(keys), count)
+        self._put(buf, NODE_HEADER.size, _encode_ints(keys))
+        self._put(buf, NODE_HEADER.size + 8 * len(keys), links)
+        return buf
+
+    def decode(self, raw):
+        _, level, num_keys, count = NODE_HEADER.unpack_from(raw, 0)
+        keys = _decode_ints(self._get(raw, NODE_HEADER.size, num_keys))
+        offset = NODE_HEADER.size + 8 * num_keys
+        if level == 0:
+            return {"level": 0, "keys": keys, "values": _decode_rids(self._get(raw, offset, 4 * count))}
+        return {"level": level, "keys": keys, "children": self._get(raw, offset, count).tolist()}
+
+
+def _encode_ints(values):
+    try:
+        return array("q", values)
+    except TypeError:
+        # Columns padded with None by write_column_to_page
+        return array("q", [NULL if v is None else v for v in values])
+
+
+def _decode_ints(values):
+    if NULL in values:
+        return [None if v == NULL else v for v in values]
+    return values.tolist()
+
+
+def _encode_rids(rids):
+    words = array("q")
+    for rid in rids:
+        if rid is None:
+            words.extend((0, 0, 0, 0))
+        elif len(rid) == 1 and rid[0] == "empty":
+            words.extend((3, 0, 0, 0))
+        else:
+            page_range, page, slot, kind = rid
+            words.extend((RID_KINDS.index(kind), page_range, page, slot))
+    return words
+
+
+def _decode_rids(words):
+    rids = []
+    for kind, page_range, page, slot in zip(words[0::4], words[1::4], words[2::4], words[3::4]):
+        if kind == 0:
+            rids.append(None)
+        elif kind == 3:
+            rids.append(["empty"])
+        else:
+            rids.append((page_range, page, slot, RID_KINDS[kind]))
+    return rids
+
+
+def _encode_timestamp(value):
+    # Timestamps are "%Y%m%d%H%M%S" strings, which fit in an int64
+    return NULL if value is None else int(value)
+
+
+def _encode_schema(value):
+    if value is None:
+        return NULL
+    return int("".join(value), 2) if value else 0
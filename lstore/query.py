@@ -1,6 +1,19 @@
 from datetime import datetime
-from lstore.config import MERGE_THRESHOLD
+from itertools import groupby
+from operator import itemgetter
+from time import perf_counter
+from functools import wraps
 from lstore.table import Record
+from lstore.page_store import NULL
+
+
+def reads_base_pages(query):
+    # Run a read query in an epoch of its table, so a merge doesn't free base pages it still uses
+    @wraps(query)
+    def run(self, *args, **kwargs):
+        with self.table.epochs.reader():
+            return query(self, *args, **kwargs)
+    return run
 
 
 class Query:
@@ -67,15 +80,33 @@ class Query:
                     return True
                 return False
 
-            # Mark the record as deleted in indirection
-            base_page.indirection[record_idx] = ["empty"]
-
-            # Also remove from page directory if it exists
-            if rid in self.table.page_directory:
-                del self.table.page_directory[rid]
+            with self.table.lock:
+                # The indexes hold the latest version's values, read them before the record goes
+                latest = self.table.page_directory.get(self._get_latest_version(rid))
+                if latest is not None:
+                    columns = latest.columns
+                else:
+                    columns = [None] * self.table.num_columns
+                    columns[self.table.key] = primary_key
+
+                # Mark the record as deleted in indirection
+                base_page.indirection[record_idx] = ["empty"]
+
+                # Also in the stored page, so the delete survives a reopen
+                bufferpool = self.table.database.bufferpool
+                page_id = ("base", page_range_idx, page_idx)
+                page_data = bufferpool.get_page(page_id, self.table.name, self.table.num_columns)
+                if record_idx < len(page_data["indirection"]):
+                    page_data["indirection"][record_idx] = ["empty"]
+                    bufferpool.set_page(page_id, self.table.name, page_data)
+                bufferpool.unpin_page(page_id, self.table.name)
+
+                # Also remove from page directory if it exists
+                if rid in self.table.page_directory:
+                    del self.table.page_directory[rid]
 
-            # Index too
-            self.table.index.delete(primary_key, rid)
+                # Index too, under the table lock so a checkpoint saves it together with the pages
+                self.table.index.delete(columns, rid)
 
             return True
 
@@ -122,6 +153,41 @@ class Query:
             print(f"Insert error for key {key}: {e}")
             return False
 
+    """
+    # Insert many records, each given as a sequence of columns
+    # Return True if every record was inserted
+    # Returns False if any record was skipped (duplicate key or locked due to 2PL)
+    """
+
+    def insert_many(self, rows):
+        """
+        Insert a batch of records, taking the table lock and pinning each base page once.
+        """
+        rows = [tuple(columns) for columns in rows]
+        if not rows:
+            return False
+
+        # If part of a transaction, acquire an exclusive lock on every key up front
+        if self.transaction and self.lock_manager:
+            for columns in rows:
+                key = columns[self.table.key]
+                if not self.lock_manager.acquire_lock(
+                    self.transaction.transaction_id, key, "insert"
+                ):
+                    return False  # Can't acquire lock, return failure
+                self.transaction.locks_held.add(key)
+
+        # Every record in the batch shares the same start time and schema encoding
+        start_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        schema_encoding = "0" * self.table.num_columns
+
+        try:
+            inserted = self.table.insert_batch(start_time, schema_encoding, rows)
+            return inserted == len(rows)
+        except Exception as e:
+            print(f"Insert error for batch: {e}")
+            return False
+
     """
     # Read matching record with specified search key
     # :param search_key: the value you want to search based on
@@ -132,6 +198,7 @@ class Query:
     # Assume that select will never be called on a key that doesn't exist
     """
 
+    @reads_base_pages
     def select(self, search_key, search_key_index, projected_columns_index):
         """
         Select a record based on search key with transaction awareness.
@@ -166,6 +233,74 @@ class Query:
                 
         return result
 
+    def scan(self, start_range, end_range, projected_columns_index, column=None, tuples=False):
+        """
+        Generator over the records whose column (the key by default) is in [start_range, end_range],
+        in column order. Yields a Record per match, or a tuple of the projected values with tuples=True.
+        The index is walked one leaf at a time and every page of a leaf's latest versions is read
+        once, so memory stays at one leaf's worth of records whatever the size of the range.
+        Inside a transaction the keys of a batch are read-locked before its rows are returned, and
+        the scan stops early if a lock can't be acquired.
+        """
+        if column is None:
+            column = self.table.key
+        projected = [i for i, include in enumerate(projected_columns_index) if include == 1]
+        needed = sorted(set(projected) | {column, self.table.key})
+
+        for rids in self.table.index.scan_range(start_range, end_range, column):
+            rows = self._scan_batch(rids, start_range, end_range, column, needed, projected)
+            if self.transaction and self.lock_manager:
+                # Lock the keys of the batch, then read it again so every row is one the lock covers.
+                # A row whose key changed before its lock was granted gets its new key locked too.
+                locked = set()
+                while True:
+                    keys = {key for _, key, _ in rows} - locked
+                    if not keys:
+                        break
+                    for key in sorted(keys):
+                        if not self.lock_manager.acquire_lock(self.transaction.transaction_id, key, "read"):
+                            return
+                        self.transaction.locks_held.add(key)
+                        locked.add(key)
+                    rows = self._scan_batch(rids, start_range, end_range, column, needed, projected)
+
+            for rid, key, columns in rows:
+                yield tuple(columns) if tuples else Record(rid, key, columns)
+
+    def _scan_batch(self, rids, start_range, end_range, column, needed, projected):
+        # (latest rid, key, projected values) of the records at rids whose column is in range.
+        # The whole batch is read at once, mapped columns are only valid until the page is written.
+        bufferpool = self.table.database.bufferpool
+        pages = {}  # (page type, range, page) -> needed columns of the page, or None
+        rows = []
+        with self.table.epochs.reader():
+            latest = self._get_latest_versions(rids)
+        for rid in latest:
+            page_range_idx, page_idx, record_idx, page_type = rid
+            page = (page_type, page_range_idx, page_idx)
+            if page not in pages:
+                page_identifier = ("base" if page_type == "b" else "tail", page_range_idx, page_idx)
+                pages[page] = bufferpool.read_columns(page_identifier, self.table.name, needed, sequential=True)
+            values = {}
+            for i, values_of_column in zip(needed, pages[page] or [[]] * len(needed)):
+                value = values_of_column[record_idx] if record_idx < len(values_of_column) else None
+                # Same defaults as Table.find_record
+                values[i] = 0 if value is None or value == NULL else value
+            # Skip stale index entries of records whose column changed since
+            if start_range <= values[column] <= end_range:
+                rows.append((rid, values[self.table.key], [values[i] for i in projected]))
+        return rows
+
+    def _get_latest_columns(self, primary_key):
+        """
+        Helper to get a copy of the latest columns of the record with primary_key, or None if there is none.
+        """
+        rids = self.table.index.locate(self.table.key, primary_key)
+        if not rids:
+            return None
+        record = self.table.page_directory.get(self._get_latest_version(rids[0]))
+        return list(record.columns) if record is not None else None
+
     def _get_latest_version(self, rid):
         """
         Helper to get the latest version of a record by following indirection.
@@ -188,6 +323,31 @@ class Query:
                 return candidate
         return rid
 
+    def _get_latest_versions(self, rids):
+        """
+        _get_latest_version for many RIDs, reading the indirection column of each base page once.
+        """
+        latest = []
+        for (page_range_idx, page_idx, page_type), group in groupby(rids, key=itemgetter(0, 1, 3)):
+            if page_type != "b":
+                latest.extend(group)
+                continue
+            indirection = self.table.page_ranges[page_range_idx].base_pages[page_idx].indirection
+            record_idxs = [rid[2] for rid in group]
+            if max(record_idxs) < len(indirection):
+                candidates = [indirection[record_idx] for record_idx in record_idxs]
+                if set(map(type, candidates)) == {tuple}:
+                    latest.extend(candidates)
+                    continue
+            # Records without an update, or indirection read back as lists
+            for record_idx in record_idxs:
+                candidate = indirection[record_idx] if record_idx < len(indirection) else None
+                if candidate is None or candidate == ["empty"]:
+                    latest.append((page_range_idx, page_idx, record_idx, "b"))
+                else:
+                    latest.append(tuple(candidate))
+        return latest
+
 
     """
     # Read matching record with specified search key
@@ -200,6 +360,7 @@ class Query:
     # Assume that select will never be called on a key that doesn't exist
     """
 
+    @reads_base_pages
     def select_version(
         self, search_key, search_key_index, projected_columns_index, relative_version
     ):
@@ -453,7 +614,7 @@ class Query:
                 column_index < len(page.pages)
                 and record_idx < page.pages[column_index].num_records
             ):
-                value = page.pages[column_index].read(record_idx, 1)[0]
+                value = page.pages[column_index].values[record_idx]
                 # Ensure it's returned as an integer
                 return int(value) if value is not None else 0
         except Exception as e:
@@ -468,6 +629,7 @@ class Query:
     """
 
     def update(self, primary_key, *columns):
+        start = perf_counter()
         # Get the RID of the record
         rids = self.table.index.locate(self.table.key, primary_key)
         if not rids:
@@ -486,6 +648,13 @@ class Query:
         page_range_idx, page_idx, record_idx, page_type = base_rid
 
         with self.table.lock:
+            # Check if the updated values lead to duplicate primary key, under the lock that moves the
+            # key so two updates can't both move a record to the same new key
+            new_key = columns[self.table.key] if len(columns) > self.table.key else None
+            if new_key is not None and new_key != primary_key:
+                if self.table.index.locate(self.table.key, new_key):
+                    return False
+
             # Initialize tail_rid so it's always defined.
             tail_rid = None
             try:
@@ -576,19 +745,14 @@ class Query:
                 if new_key != primary_key:
                     if latest_rid in self.table.page_directory:
                         del self.table.page_directory[latest_rid]
-                    if self.table.index.indices.get(self.table.key) is not None:
-                        self.table.index.delete(primary_key, latest_rid)
-                        self.table.index.insert(new_key, tail_rid)
+                # Move the base record to its new values in the indexes of the changed columns
+                self.table.index.update(current_record.columns, tail_page_columns, base_rid)
 
                 # Unpin pages from bufferpool
                 self.table.database.bufferpool.unpin_page(tail_page_id, self.table.name)
                 self.table.database.bufferpool.unpin_page(base_page_id, self.table.name)
 
-                self.table.merge_counter += 1
-                from lstore.config import MERGE_THRESHOLD
-                if self.table.merge_counter >= MERGE_THRESHOLD:
-                    self.table.merge_counter = 0
-                    self.table.trigger_merge()
+                self.table.note_update(page_range_idx, perf_counter() - start)
                     
                 return True
 
@@ -606,61 +770,79 @@ class Query:
     # Returns False if no record exists in the given range
     """
 
+    @reads_base_pages
     def sum(self, start_range, end_range, aggregate_column_index):
         """
         Sum values in a column for records in the given key range.
+        The latest versions are grouped by page, so every page is looked up once for its key and
+        aggregate columns and its records are summed together.
         """
         # Get RIDs in the range
         rids = self.table.index.locate_range(start_range, end_range, self.table.key)
         if not rids:
             return False
 
+        # Sorting puts the latest versions on the same page next to each other
+        latest = sorted(self._get_latest_versions(rids), key=itemgetter(3, 0, 1, 2))
+
         total_sum = 0
         processed_keys = set()
-
-        for rid in rids:
+        for (page_type, page_range_idx, page_idx), group in groupby(latest, key=itemgetter(3, 0, 1)):
             try:
-                # Always get the latest version of the record
-                latest_rid = self._get_latest_version(rid)
-                # Get the key value from the latest version
-                key_value = self._get_column_value(latest_rid, self.table.key)
-                if key_value is None or key_value < start_range or key_value > end_range or key_value in processed_keys:
-                    continue
-                processed_keys.add(key_value)
-                # Get the aggregate value from the latest version
-                value = self._get_column_value(latest_rid, aggregate_column_index)
-                if value is not None:
-                    total_sum += value
+                record_idxs = [rid[2] for rid in group]
+                page_identifier = ("base" if page_type == "b" else "tail", page_range_idx, page_idx)
+                columns = self.table.database.bufferpool.read_columns(
+                    page_identifier, self.table.name, (self.table.key, aggregate_column_index), sequential=True
+                )
+                if columns is None or max(record_idxs) >= min(len(columns[0]), len(columns[1])):
+                    # Not in the bufferpool or the segment file yet, read the records one at a time
+                    rids_on_page = [(page_range_idx, page_idx, record_idx, page_type) for record_idx in record_idxs]
+                    keys = [self._get_column_value(rid, self.table.key, sequential=True) for rid in rids_on_page]
+                    values = [self._get_column_value(rid, aggregate_column_index, sequential=True) for rid in rids_on_page]
+                else:
+                    # Gather the page's slots from both columns in one C-level call each
+                    gather = itemgetter(*record_idxs)
+                    keys, values = (gather(column) for column in columns)
+                    if len(record_idxs) == 1:
+                        keys, values = (keys,), (values,)
+
+                # Every key is normally new and in range, then the page's values are summed at once
+                if len(set(keys)) == len(keys) and processed_keys.isdisjoint(keys) and None not in keys \
+                        and start_range <= min(keys) and max(keys) <= end_range:
+                    processed_keys.update(keys)
+                else:
+                    selected = []
+                    for key_value, value in zip(keys, values):
+                        if key_value is None or key_value < start_range or key_value > end_range or key_value in processed_keys:
+                            continue
+                        processed_keys.add(key_value)
+                        selected.append(value)
+                    values = selected
+                if None in values or NULL in values:
+                    values = [value for value in values if value is not None and value != NULL]
+                total_sum += sum(values)
             except Exception as e:
                 print(f"Error processing record for sum: {e}")
 
         return total_sum
 
-    def _get_column_value(self, rid, column_index):
+    def _get_column_value(self, rid, column_index, sequential=False):
         """
         Helper to get a column value using bufferpool or direct access.
+        Scans pass sequential=True so the bufferpool keeps their pages out of the hot set.
         """
         page_range_idx, page_idx, record_idx, page_type = rid
         is_base = page_type == "b"
 
         try:
-            # Try bufferpool access first
+            # Try bufferpool access first, cold pages are read through the memory map
             page_identifier = ("base" if is_base else "tail", page_range_idx, page_idx)
-            page_data = self.table.database.bufferpool.get_page(
-                page_identifier, self.table.name, self.table.num_columns
+            value = self.table.database.bufferpool.read_value(
+                page_identifier, self.table.name, column_index, record_idx, sequential
             )
-
-            if (
-                "columns" in page_data
-                and column_index < len(page_data["columns"])
-                and record_idx < len(page_data["columns"][column_index])
-            ):
-                value = page_data["columns"][column_index][record_idx]
-                self.table.database.bufferpool.unpin_page(page_identifier, self.table.name)
+            if value is not None:
                 return value
 
-            self.table.database.bufferpool.unpin_page(page_identifier, self.table.name)
-
             # Fall back to direct access
             page_range = self.table.page_ranges[page_range_idx]
             page = (
@@ -673,7 +855,7 @@ class Query:
                 column_index < len(page.pages)
                 and record_idx < page.pages[column_index].num_records
             ):
-                return page.pages[column_index].read(record_idx, 1)[0]
+                return page.pages[column_index].values[record_idx]
         except Exception as e:
             print(f"Error getting column value: {e}")
 
@@ -690,6 +872,7 @@ class Query:
     
     """
 
+    @reads_base_pages
     def sum_version(
         self, start_range, end_range, aggregate_column_index, relative_version
     ):
@@ -707,7 +890,7 @@ class Query:
         for base_rid in rids:
             try:
                 # Get the key value to verify range and avoid duplicates
-                key_value = self._get_column_value(base_rid, self.table.key)
+                key_value = self._get_column_value(base_rid, self.table.key, sequential=True)
 
                 if (
                     key_value < start_range
@@ -721,13 +904,13 @@ class Query:
                 # For version 0 (current), get the latest version
                 if relative_version == 0:
                     target_rid = self._safely_get_latest_version(base_rid)
-                    value = self._get_column_value(target_rid, aggregate_column_index)
+                    value = self._get_column_value(target_rid, aggregate_column_index, sequential=True)
                     total_sum += int(value)
 
                 # For version -1 (original/base record)
                 elif relative_version == -1:
                     # Use the base record directly
-                    value = self._get_column_value(base_rid, aggregate_column_index)
+                    value = self._get_column_value(base_rid, aggregate_column_index, sequential=True)
                     total_sum += int(value)
 
                 # For other historical versions
@@ -738,13 +921,11 @@ class Query:
                         target_rid = self._safely_get_historical_version(
                             latest_rid, base_rid, abs(relative_version)
                         )
-                        value = self._get_column_value(
-                            target_rid, aggregate_column_index
-                        )
+                        value = self._get_column_value(target_rid, aggregate_column_index, sequential=True)
                         total_sum += int(value)
                     else:
                         # No updates, use base
-                        value = self._get_column_value(base_rid, aggregate_column_index)
+                        value = self._get_column_value(base_rid, aggregate_column_index, sequential=True)
                         total_sum += int(value)
 
             except Exception as e:
@@ -0,0 +1,165 @@
+from threading import Thread
+from lstore.query import Query
+
+
+class Recovery:
+    """
+    Restart recovery, run by Database.open once the last checkpoint is loaded.
+    The log holds logical records (a key with its before- and after-image), so every step
+    compares the image in the table with the logged one before changing anything. That makes
+    redo and undo idempotent, and running recovery twice after a crash during recovery is safe.
+    An intent record without the query record that follows it is a query the crash interrupted.
+
+    analysis    start at the redo LSN of the last checkpoint record, replay table creation and
+                drops, and split the transactions into finished ones (committed or aborted) and
+                losers still running at the crash
+    redo        repeat history: reapply the after-images of finished transactions in LSN order.
+                An aborted transaction's rollback is in the log as compensation records, so
+                redoing it leaves its keys as they were after the abort.
+    undo        roll back the losers' changes that are in the table, newest first, skipping
+                compensation records. Every rollback is logged as a compensation record and the
+                losers get an abort record, so a later recovery redoes them instead.
+
+    Redo and undo run one thread per table, since records of different tables never interact.
+    A record that fails to apply makes recovery, and with it Database.open, fail.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.log = db.log
+        self.errors = []  # (LSN, exception) of the records that failed to apply
+
+    def run(self):
+        records = list(self.log.records())
+        start = 0
+        for record in records:
+            if record["type"] == "checkpoint":
+                start = record["redo"]
+        # Changes older than that are in the checkpointed pages, and so are the tables in db_metadata
+        records = [record for record in records if record["lsn"] >= start]
+        if not records:
+            return
+
+        finished, losers, open_transactions = self.analyze(records)
+        self._per_table(finished, self.redo)
+        self._per_table(losers[::-1], self.undo)
+
+        # End the unfinished transactions, so a later transaction reusing an id doesn't inherit them
+        for transaction_id in open_transactions:
+            self.log.abort(transaction_id)
+        self.log.flush()
+
+    def analyze(self, records):
+        """
+        Returns (query records of finished transactions, query and intent records of losers, ids
+        still open at the crash), in LSN order. A commit or abort record ends a transaction, so ids
+        reused later start a new one.
+        """
+        running = {}  # transaction id -> its query records so far, and the intent of the one running
+        finished = []
+        for record in records:
+            kind = record["type"]
+            if kind in ("intent", "query"):
+                transaction_records = running.setdefault(record["txn"], [])
+                if kind == "query" and transaction_records and transaction_records[-1]["type"] == "intent":
+                    transaction_records.pop()  # the query record covers its intent
+                transaction_records.append(record)
+            elif kind in ("commit", "abort"):
+                finished.extend(r for r in running.pop(record["txn"], []) if r["type"] == "query")
+            elif kind == "create_table":
+                if not any(table.name == record["name"] for table in self.db.tables):
+                    self.db.create_table(record["name"], record["num_columns"], record["key"])
+            elif kind == "drop_table":
+                if any(table.name == record["name"] for table in self.db.tables):
+                    self.db.drop_table(record["name"])
+
+        losers = [r for rs in running.values() for r in rs]
+        finished.sort(key=lambda r: r["lsn"])
+        losers.sort(key=lambda r: r["lsn"])
+        return finished, losers, list(running)
+
+    def _per_table(self, records, apply):
+        by_table = {}
+        for record in records:
+            by_table.setdefault(record["table"], []).append(record)
+
+        threads = []
+        for table_name, table_records in by_table.items():
+            try:
+                table = self.db.get_table(table_name)
+            except Exception:
+                continue  # dropped later in the log
+            thread = Thread(target=self._apply_all, args=(apply, Query(table), table_records))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            lsn, error = min(self.errors, key=lambda failed: failed[0])
+            raise Exception(f"Recovery failed at LSN {lsn}: {error}") from error
+
+    def _apply_all(self, apply, query, records):
+        # Stop at the first failure, the records after it may depend on it
+        for record in records:
+            try:
+                apply(query, record)
+            except Exception as e:
+                self.errors.append((record["lsn"], e))
+                return
+
+    def redo(self, query, record):
+        key, after = record["key"], record["redo"]
+        table_key = query.table.key
+        if after is None:
+            # Delete
+            if query._get_latest_columns(key) is not None:
+                query.delete(key)
+            return
+
+        new_key = after[table_key]
+        current = query._get_latest_columns(new_key)
+        if current == after:
+            return  # already in the table
+        if new_key != key and query._get_latest_columns(key) is not None:
+            # Update that changed the key
+            query.update(key, *after)
+        elif current is not None:
+            query.update(new_key, *[None if i == table_key else v for i, v in enumerate(after)])
+        else:
+            query.insert(*after)
+
+    def undo(self, query, record):
+        if record.get("clr"):
+            return  # a rollback, the change it rolled back is undone by its own record if needed
+        key, before = record["key"], record["undo"]
+        if record["type"] == "intent":
+            # The query may have changed the record partway, put the before-image back if it differs
+            if query._get_latest_columns(key) != before:
+                self._compensate(query, record, key, before)
+            return
+
+        after = record["redo"]
+        if after is None:
+            # Delete: put the record back if it is gone
+            if before is not None and query._get_latest_columns(key) is None:
+                self._compensate(query, record, key, before)
+            return
+
+        after_key = after[query.table.key]
+        if query._get_latest_columns(after_key) != after:
+            return  # the change isn't in the table
+        self._compensate(query, record, after_key, before)
+
+    def _compensate(self, query, record, key, target):
+        # Bring the record at key to target (None: no record) and log it as a compensation record
+        current = query._get_latest_columns(key)
+        self.log.log_intent(record["txn"], record["table"], key, current, compensation=True)
+        if target is None:
+            query.delete(key)
+        elif current is None:
+            query.insert(*target)
+        else:
+            # Also moves the record back to the target's key if the change moved it
+            query.update(key, *target)
+        after_key = key if target is None else target[query.table.key]
+        self.log.log_query(record["txn"], record["table"], key, current, query._get_latest_columns(after_key), compensation=True)
@@ -0,0 +1,314 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class ReplacementPolicy(ABC):
+    """
+    Decides which unpinned frame the Bufferpool evicts.
+    The Bufferpool tells the policy when a frame is pinned (accessed) and when its pin count drops to zero.
+    Only unpinned frames are kept in the eviction structures, so pinned frames are never scanned.
+    A sequential access is a hint that the page belongs to a scan and should not displace the hot set.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    @abstractmethod
+    def pinned(self, key, sequential=False):
+        # The frame was accessed and pinned, either as a hit or right after loading it
+        pass
+
+    @abstractmethod
+    def unpinned(self, key):
+        # The frame's pin count dropped to zero, so it may be evicted
+        pass
+
+    @abstractmethod
+    def victim(self):
+        # Choose an unpinned frame to evict and forget it, or return None if every frame is pinned
+        pass
+
+    @abstractmethod
+    def remove(self, key):
+        # Forget a frame that left the bufferpool without going through victim()
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class LRUPolicy(ReplacementPolicy):
+    """
+    Least recently used. Pages from sequential accesses go to the cold end so scans evict each other first.
+    """
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.evictable = OrderedDict()  # unpinned frames, least recently used first
+        self.sequential = set()  # frames whose last access was sequential
+
+    def pinned(self, key, sequential=False):
+        self.evictable.pop(key, None)
+        if sequential:
+            self.sequential.add(key)
+        else:
+            self.sequential.discard(key)
+
+    def unpinned(self, key):
+        self.evictable[key] = None
+        self.evictable.move_to_end(key, last=key not in self.sequential)
+
+    def victim(self):
+        if not self.evictable:
+            return None
+        key, _ = self.evictable.popitem(last=False)
+        self.sequential.discard(key)
+        return key
+
+    def remove(self, key):
+        self.evictable.pop(key, None)
+        self.sequential.discard(key)
+
+    def clear(self):
+        self.evictable.clear()
+        self.sequential.clear()
+
+
+class ClockPolicy(ReplacementPolicy):
+    """
+    CLOCK (second chance). The ring holds unpinned frames with their reference bits,
+    and the hand is the front of the ring. Sequential accesses leave the reference bit clear.
+    """
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.ring = OrderedDict()  # unpinned frame -> reference bit, the hand points at the front
+        self.referenced = {}  # frame -> reference bit of its last access
+
+    def pinned(self, key, sequential=False):
+        self.ring.pop(key, None)
+        self.referenced[key] = 0 if sequential else 1
+
+    def unpinned(self, key):
+        bit = self.referenced.get(key, 1)
+        self.ring[key] = bit
+        # Scan pages go right under the hand so they are replaced before the hot set loses its bits
+        if not bit:
+            self.ring.move_to_end(key, last=False)
+
+    def victim(self):
+        # Every frame is passed over at most once before one with a clear bit comes around
+        while self.ring:
+            key, bit = self.ring.popitem(last=False)
+            if bit:
+                self.ring[key] = 0
+                continue
+            self.referenced.pop(key, None)
+            return key
+        return None
+
+    def remove(self, key):
+        self.ring.pop(key, None)
+        self.referenced.pop(key, None)
+
+    def clear(self):
+        self.ring.clear()
+        self.referenced.clear()
+
+
+class TwoQueuePolicy(ReplacementPolicy):
+    """
+    2Q. New pages enter the A1in FIFO and are only promoted to the Am LRU when they are
+    accessed again after leaving A1in (tracked by the A1out ghost list).
+    Sequential pages never leave a ghost behind, so a scan can't be promoted into Am.
+    A1in keeps every resident frame in arrival order, pinned or not, so hits never move a page
+    back. Eviction skips the pinned ones, of which there are only as many as concurrent pins.
+    """
+
+    def __init__(self, capacity, in_ratio=0.25, out_ratio=0.5):
+        super().__init__(capacity)
+        self.in_size = max(1, int(capacity * in_ratio))
+        self.out_size = max(1, int(capacity * out_ratio))
+        self.queue = {}  # resident frame -> "a1in" or "am"
+        self.a1in = OrderedDict()  # resident frames in A1in, pinned or not, oldest first
+        self.a1in_pinned = set()  # frames of A1in that are pinned
+        self.am = OrderedDict()  # unpinned frames in Am, least recently used first
+        self.a1out = OrderedDict()  # ghosts of frames evicted from A1in
+        self.sequential = set()
+
+    def pinned(self, key, sequential=False):
+        if sequential:
+            self.sequential.add(key)
+        else:
+            self.sequential.discard(key)
+
+        queue = self.queue.get(key)
+        if queue == "am":
+            self.am.pop(key, None)
+            return
+        if queue is None:
+            if key in self.a1out and not sequential:
+                # Seen again after leaving A1in, so the page is hot
+                del self.a1out[key]
+                self.queue[key] = "am"
+                return
+            self.a1out.pop(key, None)
+            self.queue[key] = "a1in"
+            self.a1in[key] = None
+        self.a1in_pinned.add(key)
+        # Scan pages are the first to leave A1in
+        if sequential:
+            self.a1in.move_to_end(key, last=False)
+
+    def unpinned(self, key):
+        if self.queue.get(key) == "am":
+            self.am[key] = None
+        else:
+            # A1in is a FIFO, the frame keeps the place it got when it entered
+            self.a1in_pinned.discard(key)
+
+    def victim(self):
+        key = None
+        if len(self.a1in) > self.in_size or not self.am:
+            key = next((key for key in self.a1in if key not in self.a1in_pinned), None)
+        if key is not None:
+            del self.a1in[key]
+            if key not in self.sequential:
+                self.a1out[key] = None
+                while len(self.a1out) > self.out_size:
+                    self.a1out.popitem(last=False)
+        elif self.am:
+            key, _ = self.am.popitem(last=False)
+        else:
+            return None
+        del self.queue[key]
+        self.sequential.discard(key)
+        return key
+
+    def remove(self, key):
+        self.queue.pop(key, None)
+        self.a1in.pop(key, None)
+        self.a1in_pinned.discard(key)
+        self.am.pop(key, None)
+        self.sequential.discard(key)
+
+    def clear(self):
+        self.queue.clear()
+        self.a1in.clear()
+        self.a1in_pinned.clear()
+        self.am.clear()
+        self.a1out.clear()
+        self.sequential.clear()
+
+
+class ARCPolicy(ReplacementPolicy):
+    """
+    Adaptive Replacement Cache. T1 holds pages seen once recently and T2 pages seen at least twice.
+    The ghost lists B1 and B2 remember recent evictions from each, and hits on them move the
+    target size p of T1. Sequential accesses stay in T1 and neither consult nor feed the ghosts.
+    """
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.p = 0  # target number of resident frames in T1
+        self.queue = {}  # resident frame -> "t1" or "t2"
+        self.t1 = OrderedDict()  # unpinned frames in T1, least recently used first
+        self.t2 = OrderedDict()  # unpinned frames in T2, least recently used first
+        self.b1 = OrderedDict()  # ghosts of frames evicted from T1
+        self.b2 = OrderedDict()  # ghosts of frames evicted from T2
+        self.t1_count = 0  # resident frames in T1, pinned or not
+        self.sequential = set()
+
+    def pinned(self, key, sequential=False):
+        if sequential:
+            self.sequential.add(key)
+        else:
+            self.sequential.discard(key)
+
+        queue = self.queue.get(key)
+        if queue is not None:
+            self.t1.pop(key, None)
+            self.t2.pop(key, None)
+            # A repeated, non-sequential hit moves the page to the frequency side
+            if queue == "t1" and not sequential:
+                self.queue[key] = "t2"
+                self.t1_count -= 1
+            return
+
+        if not sequential and key in self.b1:
+            # T1 was too small: grow its target
+            self.p = min(self.capacity, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[key]
+            self.queue[key] = "t2"
+        elif not sequential and key in self.b2:
+            # T2 was too small: shrink T1's target
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[key]
+            self.queue[key] = "t2"
+        else:
+            self.b1.pop(key, None)
+            self.b2.pop(key, None)
+            self.queue[key] = "t1"
+            self.t1_count += 1
+
+    def unpinned(self, key):
+        if self.queue.get(key) == "t2":
+            self.t2[key] = None
+        else:
+            self.t1[key] = None
+            # Scan pages go to the cold end of T1
+            self.t1.move_to_end(key, last=key not in self.sequential)
+
+    def victim(self):
+        if self.t1 and (self.t1_count > self.p or not self.t2):
+            key, _ = self.t1.popitem(last=False)
+            self.t1_count -= 1
+            ghosts = self.b1
+        elif self.t2:
+            key, _ = self.t2.popitem(last=False)
+            ghosts = self.b2
+        else:
+            return None
+
+        del self.queue[key]
+        if key in self.sequential:
+            self.sequential.discard(key)
+        else:
+            ghosts[key] = None
+            while len(ghosts) > self.capacity:
+                ghosts.popitem(last=False)
+        return key
+
+    def remove(self, key):
+        queue = self.queue.pop(key, None)
+        if queue == "t1":
+            self.t1_count -= 1
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+        self.sequential.discard(key)
+
+    def clear(self):
+        self.p = 0
+        self.queue.clear()
+        self.t1.clear()
+        self.t2.clear()
+        self.b1.clear()
+        self.b2.clear()
+        self.t1_count = 0
+        self.sequential.clear()
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "clock": ClockPolicy,
+    "2q": TwoQueuePolicy,
+    "arc": ARCPolicy,
+}
+
+
+def create_policy(name, capacity):
+    # Build the replacement policy registered under name
+    if name not in POLICIES:
+        raise Exception(f"Unknown replacement policy {name}")
+    return POLICIES[name](capacity)
@@ -0,0 +1,118 @@
+from threading import Lock
+
+
+COUNTERS = (
+    "hits",
+    "misses",
+    "mapped_reads",
+    "evictions",
+    "dirty_writes",
+    "background_writes",
+    "checkpoint_writes",
+    "forced_evictions",
+    "bytes_read",
+    "bytes_written",
+)
+
+
+class LatencyHistogram:
+    """
+    Power-of-two histogram of latencies in microseconds.
+    Bucket i counts samples below 2 ** i microseconds (the last bucket has no upper bound).
+    """
+
+    def __init__(self, num_buckets=24):
+        self.buckets = [0] * num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = seconds * 1_000_000
+        bucket = min(int(micros).bit_length(), len(self.buckets) - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += micros
+        self.max = max(self.max, micros)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count if self.count else 0.0,
+            "max_us": self.max,
+            # Upper bound in microseconds -> samples, leaving out empty buckets
+            "buckets": {2 ** i: n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+class BufferpoolStats:
+    """
+    Global and per-table counters for a Bufferpool, plus latency histograms for disk loads and write-backs.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = dict.fromkeys(COUNTERS, 0)
+            self.tables = {}  # table_name -> counters
+            self.load_latency = LatencyHistogram()
+            self.write_latency = LatencyHistogram()
+
+    def add(self, table_name, counter, amount=1):
+        with self.lock:
+            self.totals[counter] += amount
+            table = self.tables.get(table_name)
+            if table is None:
+                table = self.tables[table_name] = dict.fromkeys(COUNTERS, 0)
+            table[counter] += amount
+
+    def record_load(self, table_name, seconds, num_bytes):
+        # A page read from disk on a miss
+        self.add(table_name, "bytes_read", num_bytes)
+        with self.lock:
+            self.load_latency.record(seconds)
+
+    def record_write(self, table_name, seconds, num_bytes):
+        # A dirty page written back to disk
+        self.add(table_name, "dirty_writes")
+        self.add(table_name, "bytes_written", num_bytes)
+        with self.lock:
+            self.write_latency.record(seconds)
+
+    def snapshot(self, pins):
+        """
+        Returns a copy of every counter. pins maps (table_name, page_id) to the current pin count.
+        """
+        with self.lock:
+            tables = {name: dict(counters) for name, counters in self.tables.items()}
+            totals = dict(self.totals)
+            load_latency = self.load_latency.snapshot()
+            write_latency = self.write_latency.snapshot()
+
+        pinned_pages = 0
+        total_pins = 0
+        for (table_name, _), count in pins.items():
+            table = tables.setdefault(table_name, dict.fromkeys(COUNTERS, 0))
+            table["pinned_pages"] = table.get("pinned_pages", 0) + (1 if count else 0)
+            table["pins"] = table.get("pins", 0) + count
+            pinned_pages += 1 if count else 0
+            total_pins += count
+        for table in tables.values():
+            table.setdefault("pinned_pages", 0)
+            table.setdefault("pins", 0)
+            lookups = table["hits"] + table["misses"]
+            table["hit_ratio"] = table["hits"] / lookups if lookups else 0.0
+
+        lookups = totals["hits"] + totals["misses"]
+        totals["hit_ratio"] = totals["hits"] / lookups if lookups else 0.0
+        totals["pinned_pages"] = pinned_pages
+        totals["pins"] = total_pins
+        return {
+            "global": totals,
+            "tables": tables,
+            "load_latency": load_latency,
+            "write_latency": write_latency,
+        }
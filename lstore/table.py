@@ -1,7 +1,9 @@
 from lstore.index import Index
 from lstore.page_range import PageRange
-from lstore.page import BasePage, LogicalPage
-from lstore.config import MERGE_THRESHOLD
+from lstore.page import BasePage
+from lstore.config import MERGE_THRESHOLD, RECORDS_PER_PAGE
+from lstore.page_store import NULL
+from lstore.epoch import EpochManager
 import threading
 from datetime import datetime
 
@@ -28,46 +30,187 @@ class Record:
         return str(self.columns)
 
 
+class PageDirectory(dict):
+    """
+    rid -> Record map of a table.
+    Every record holds the same columns as its slot in a base or tail page, so the directory can
+    be rebuilt from the stored pages and only the rids deleted from it have to be saved.
+    It remembers the rids deleted since the last checkpoint for that.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.changed = set()
+
+    def __delitem__(self, rid):
+        super().__delitem__(rid)
+        self.changed.add(rid)
+
+    def changes(self):
+        """
+        Returns the rids deleted since the last mark_saved().
+        """
+        return list(self.changed)
+
+    def mark_saved(self, rids=None):
+        # Forget the deletes of rids (default: all of them), they are on disk now
+        if rids is None:
+            self.changed.clear()
+        else:
+            self.changed.difference_update(rids)
+
+    def add_page(self, page_data, key, deleted=()):
+        # Add the records of a stored page, except the deleted ones and any rid already present
+        for rid, *columns in zip(page_data["rid"], *page_data["columns"]):
+            if rid is not None and rid not in deleted and not dict.__contains__(self, rid):
+                dict.__setitem__(self, rid, Record(rid, columns[key], columns))
+
+    def column_values(self, rids, column):
+        # One column of the record at each rid, None where there is no record
+        values = []
+        for rid in rids:
+            record = self.get(rid)
+            values.append(None if record is None else record.columns[column])
+        return values
+
+
+class LazyPageDirectory(PageDirectory):
+    """
+    Page directory of a lazily opened table. The records of a stored page are loaded the first
+    time one of its rids is looked up, and iterating or sizing the directory loads them all.
+    read_page(page_id) returns the page data, read_column(page_id, column) one stored column.
+    """
+
+    def __init__(self, key, page_ids, deleted, read_page, read_column):
+        super().__init__()
+        self.key = key
+        self.unloaded = set(page_ids)
+        self.deleted = set(deleted)  # rids never to load, deleted before or since opening
+        self.read_page = read_page
+        self.read_column = read_column
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _page_of(rid):
+        return ("base" if rid[3] == "b" else "tail", rid[0], rid[1])
+
+    def _load(self, page_id):
+        # Returns False if the page was loaded already
+        if page_id not in self.unloaded:
+            return False
+        with self.lock:
+            if page_id in self.unloaded:
+                self.add_page(self.read_page(page_id), self.key, self.deleted)
+                self.unloaded.discard(page_id)
+        return True
+
+    def load_all(self):
+        for page_id in list(self.unloaded):
+            self._load(page_id)
+
+    def __missing__(self, rid):
+        if self._load(self._page_of(rid)) and dict.__contains__(self, rid):
+            return dict.__getitem__(self, rid)
+        raise KeyError(rid)
+
+    def __contains__(self, rid):
+        if dict.__contains__(self, rid):
+            return True
+        return self._load(self._page_of(rid)) and dict.__contains__(self, rid)
+
+    def get(self, rid, default=None):
+        return self[rid] if rid in self else default
+
+    def __delitem__(self, rid):
+        if rid not in self:
+            raise KeyError(rid)
+        super().__delitem__(rid)
+        self.deleted.add(rid)
+
+    def column_values(self, rids, column):
+        # Pages whose records aren't loaded are read a column at a time instead of loading them
+        columns = {}
+        values = []
+        for rid in rids:
+            page_id = self._page_of(rid)
+            if page_id in self.unloaded and rid not in self.deleted:
+                stored = columns.get(page_id)
+                if stored is None:
+                    stored = columns[page_id] = self.read_column(page_id, column) or ()
+                value = stored[rid[2]] if rid[2] < len(stored) else None
+                values.append(None if value == NULL else value)
+            else:
+                record = self.get(rid)
+                values.append(None if record is None else record.columns[column])
+        return values
+
+    def __len__(self):
+        self.load_all()
+        return super().__len__()
+
+    def __iter__(self):
+        self.load_all()
+        return super().__iter__()
+
+    def keys(self):
+        self.load_all()
+        return super().keys()
+
+    def values(self):
+        self.load_all()
+        return super().values()
+
+    def items(self):
+        self.load_all()
+        return super().items()
+
+
 class Table:
     def __init__(self, name, num_columns, key):
         self.name = name
         self.key = key
         self.num_columns = num_columns
-        self.page_directory = {}
+        self.page_directory = PageDirectory()
         self.index = Index(self)
         self.page_ranges = []
         self.merge_counter = 0
         self.lock = threading.Lock()
+        self.merge_lock = threading.Lock()  # serializes merges, which only take self.lock briefly
+        self.epochs = EpochManager()  # readers of base pages a merge may replace
         self.database = None  # Add this line to store the database reference
+        self.append_cursor = (0, 0)  # (page_range_id, page_id) of the base page new records go to
 
         # Initialize the first page range
         self.add_page_range(num_columns)
 
     def find_current_base_page(self):
-        # Find the first base page with capacity
-        for page_range in self.page_ranges:
-            for base_page in page_range.base_pages:
+        # Start from the append cursor instead of scanning every page range and base page
+        # The cursor only moves forward, so placing a record costs the same however large the table is
+        page_range_id, page_id = self.append_cursor
+        while True:
+            page_range = self.page_ranges[page_range_id]
+            if page_id < len(page_range.base_pages):
+                base_page = page_range.base_pages[page_id]
                 if base_page.has_capacity():
-                    return page_range, base_page
-
-        # If no base page has capacity, create a new base page
-        if not self.page_ranges[-1].has_capacity():
-            self.add_page_range(self.num_columns)
-        self.page_ranges[-1].add_base_page(self.num_columns)
-
-        return self.page_ranges[-1], self.page_ranges[-1].base_pages[-1]
+                    self.append_cursor = (page_range_id, page_id)
+                    return page_range_id, page_id, page_range, base_page
+                page_id += 1
+            elif page_range.has_capacity():
+                # If no base page has capacity, create a new base page
+                page_range.add_base_page(self.num_columns)
+            else:
+                # Move on to the next page range, creating it if needed
+                if page_range_id + 1 == len(self.page_ranges):
+                    self.add_page_range(self.num_columns)
+                page_range_id += 1
+                page_id = 0
 
     def create_rid(self):
-        # Get the current base page
-        page_range, base_page = self.find_current_base_page()
+        # Get the current base page and its next free slot
+        page_range_id, page_id, page_range, base_page = self.find_current_base_page()
 
         # Create a new rid for a base page record
-        rid = (
-            self.page_ranges.index(page_range),
-            page_range.base_pages.index(base_page),
-            base_page.num_records,
-            "b",
-        )
+        rid = (page_range_id, page_id, base_page.num_records, "b")
         base_page.rid.append(rid)  # Ensure the rid is appended to the list
 
         return rid
@@ -75,50 +218,37 @@ class Table:
     def find_record(self, key, rid, projected_columns_index):
         """
         Find a record in the bufferpool using its RID.
+        Reads go through the bufferpool only, so this doesn't take the table lock.
         """
-        with self.lock:
-            
-            # Extract the page type and location from the RID
-            page_range_idx, page_idx, record_idx, page_type = rid
-
-            # Determine if we're looking at a base or tail page
-            is_base_page = page_type == "b"
-            page_type_str = "base" if is_base_page else "tail"
-
-            # Create a page identifier for the bufferpool
-            page_identifier = (page_type_str, page_range_idx, page_idx)
-
-            # Get the page from the bufferpool
-            page_data = self.database.bufferpool.get_page(
-                page_identifier, self.name, self.num_columns
-            )
-
-            # Extract the values for the projected columns
-            values = []
-            for i, include in enumerate(projected_columns_index):
-                if include == 1:
-                    # Only include columns that are requested
-                    try:
-                        if (
-                                "columns" in page_data
-                                and i < len(page_data["columns"])
-                                and record_idx < len(page_data["columns"][i])
-                        ):
-                            # Append the value from the specified column at the record index
-                            values.append(page_data["columns"][i][record_idx])
-                        else:
-                            # Default to 0 if column data is missing or index is out of bounds
-                            values.append(0)
-                    except Exception as e:
-                        # Handle any errors, defaulting to 0
-                        print(f"Error reading column {i} value: {e}")
-                        values.append(0)
-
-            # Unpin the page when done
-            self.database.bufferpool.unpin_page(page_identifier, self.name)
+        # Extract the page type and location from the RID
+        page_range_idx, page_idx, record_idx, page_type = rid
+
+        # Determine if we're looking at a base or tail page
+        is_base_page = page_type == "b"
+        page_type_str = "base" if is_base_page else "tail"
+
+        # Create a page identifier for the bufferpool
+        page_identifier = (page_type_str, page_range_idx, page_idx)
+
+        # Extract the values for the projected columns, reading pages that aren't
+        # resident through the memory map instead of loading them
+        values = []
+        for i, include in enumerate(projected_columns_index):
+            if include == 1:
+                # Only include columns that are requested
+                try:
+                    value = self.database.bufferpool.read_value(
+                        page_identifier, self.name, i, record_idx
+                    )
+                    # Default to 0 if column data is missing or index is out of bounds
+                    values.append(0 if value is None else value)
+                except Exception as e:
+                    # Handle any errors, defaulting to 0
+                    print(f"Error reading column {i} value: {e}")
+                    values.append(0)
 
-            # Create a record with the extracted values
-            return Record(rid, key, values)
+        # Create a record with the extracted values
+        return Record(rid, key, values)
 
     def insert_record(self, start_time, schema_encoding, *columns):
         """
@@ -133,13 +263,9 @@ class Table:
             
             try:
                 # Get the current base page
-                page_range, base_page = self.find_current_base_page()
+                page_range_id, page_id, page_range, base_page = self.find_current_base_page()
                 record_index = base_page.num_records  # Current index for the new record
 
-                # Determine page identifiers
-                page_range_id = self.page_ranges.index(page_range)
-                page_id = page_range.base_pages.index(base_page)
-
                 # Create RID
                 rid = (page_range_id, page_id, record_index, "b")
 
@@ -201,15 +327,91 @@ class Table:
                 record = Record(rid, columns[self.key], list(columns))
                 self.page_directory[rid] = record
 
-                # Insert key to the index
-                key = columns[self.key]
-                self.index.insert(key, rid)
+                # Index the new record
+                self.index.insert(record.columns, rid)
 
                 return True
             except Exception as e:
                 print(f"Error in insert_record: {e}")
                 return False
 
+    def insert_batch(self, start_time, schema_encoding, rows):
+        """
+        Insert many records at once, filling whole base pages per bufferpool round trip.
+        Rows whose key already exists (or repeats within the batch) are skipped.
+        Returns the number of records inserted.
+        """
+        with self.lock:
+            # Check every key against the index once for the whole batch
+            existing = self.index.existing_values(self.key, [columns[self.key] for columns in rows])
+            pending = []
+            for columns in rows:
+                key = columns[self.key]
+                if key in existing:
+                    continue
+                existing.add(key)
+                pending.append(columns)
+
+            index_entries = []
+            position = 0
+            try:
+                while position < len(pending):
+                    # Get the current base page and take as many rows as it can still hold
+                    page_range_id, page_id, page_range, base_page = self.find_current_base_page()
+                    chunk = pending[position:position + RECORDS_PER_PAGE - base_page.num_records]
+                    first_index = base_page.num_records
+                    rids = [(page_range_id, page_id, first_index + i, "b") for i in range(len(chunk))]
+
+                    # Pin the page once for the whole chunk
+                    page_identifier = ("base", page_range_id, page_id)
+                    page_data = self.database.bufferpool.get_page(
+                        page_identifier, self.name, self.num_columns
+                    )
+
+                    # Make sure the page has the expected structure
+                    if "columns" not in page_data:
+                        page_data["columns"] = [[] for _ in range(self.num_columns)]
+                    while len(page_data["columns"]) < self.num_columns:
+                        page_data["columns"].append([])
+                    for field in ("indirection", "rid", "timestamp", "schema_encoding"):
+                        if field not in page_data:
+                            page_data[field] = []
+
+                    # Append the record metadata and each column as one run
+                    page_data["indirection"].extend(rids)
+                    page_data["rid"].extend(rids)
+                    page_data["timestamp"].extend([start_time] * len(chunk))
+                    page_data["schema_encoding"].extend([schema_encoding] * len(chunk))
+                    for i in range(self.num_columns):
+                        values = [columns[i] for columns in chunk]
+                        page_data["columns"][i].extend(values)
+                        base_page.pages[i].write_many(values)
+
+                    # Update the page in the bufferpool and unpin it
+                    self.database.bufferpool.set_page(page_identifier, self.name, page_data)
+                    self.database.bufferpool.unpin_page(page_identifier, self.name)
+
+                    # Update the base_page metadata
+                    base_page.num_records += len(chunk)
+                    base_page.indirection.extend(rids)
+                    base_page.schema_encoding.extend([schema_encoding] * len(chunk))
+                    base_page.start_time.extend([start_time] * len(chunk))
+                    base_page.rid.extend(rids)
+
+                    # Add to page directory
+                    for rid, columns in zip(rids, chunk):
+                        self.page_directory[rid] = Record(rid, columns[self.key], list(columns))
+                        index_entries.append((columns, rid))
+
+                    position += len(chunk)
+            except Exception as e:
+                print(f"Error in insert_batch: {e}")
+            finally:
+                # Index every stored record, one sorted run per tree
+                self.index.insert_many(index_entries)
+
+            return len(index_entries)
+
     def update(self, primary_key, *columns):
         
         with self.lock:
@@ -278,114 +480,94 @@ class Table:
         page_range = PageRange(num_columns)
         self.page_ranges.append(page_range)
 
+    def note_update(self, page_range_id, seconds):
+        # An update appended a tail record to the page range, report it to the merge scheduler
+        if self.database is not None and self.database.merge_scheduler is not None:
+            self.database.merge_scheduler.note_update(self, page_range_id, seconds)
+            return
+        self.merge_counter += 1
+        if self.merge_counter >= MERGE_THRESHOLD:
+            self.merge_counter = 0
+            self.trigger_merge()
+
     def trigger_merge(self):
         # print("<----triggering merge---->")
         merge_thread = threading.Thread(target=self.merge)
         merge_thread.start()
 
     def merge(self):
-        with self.lock:
-            # print("<----merging---->")
-            for page_range in self.page_ranges:
-                merged_base_pages = []
-                for base_page in page_range.base_pages:
-                    # Create a copy of the base page
-                    merged_base_page = BasePage(self.num_columns)
-                    merged_base_page.pages = [
-                        LogicalPage() for _ in range(self.num_columns)
-                    ]
-
-                    # Copy the base page records to the merged base page
-                    for i in range(base_page.num_records):
-                        for j in range(self.num_columns):
-                            value = base_page.pages[j].read(i, 1)[0]
-                            merged_base_page.pages[j].write(value)
-                        merged_base_page.indirection.append(base_page.indirection[i])
-                        merged_base_page.schema_encoding.append(
-                            base_page.schema_encoding[i]
-                        )
-                        merged_base_page.start_time.append(base_page.start_time[i])
-                        merged_base_page.rid.append(base_page.rid[i])
-                        
-                        merged_base_page.num_records += 1
-
-                    # Track the latest updates for each base record
-                    latest_updates = {}  # base_rid -> (tail_page_index, record_index)
-                    for tail_page_index, tail_page in enumerate(
-                        reversed(page_range.tail_pages)
-                    ):
-                        for record_index in range(tail_page.num_records):
-                            base_rid = tail_page.indirection[record_index]
-                            if base_rid in base_page.rid:
-                                latest_updates[base_rid] = (
-                                    len(page_range.tail_pages) - 1 - tail_page_index,
-                                    record_index,
-                                )
-
-                    # Apply only the most recent updates
-                    updated_columns = {tuple(base_rid): set() for base_rid in list(base_page.rid)}
-                    for base_rid, (
-                        tail_page_index,
-                        record_index,
-                    ) in latest_updates.items():
-                        tail_page = page_range.tail_pages[tail_page_index]
-                        base_index = base_page.rid.index(base_rid)
-                        for j in range(self.num_columns):
-                            if (
-                                record_index < len(tail_page.schema_encoding)
-                                and tail_page.schema_encoding[record_index][j] == "1"
-                                and j not in updated_columns[base_rid]
-                            ):
-                                value = tail_page.pages[j].read(record_index, 1)[0]
-                                merged_base_page.pages[j].write(value)
-                                updated_columns[base_rid].add(j)
-
-                    # Traverse the lineage to incorporate all recent updates
-                    for i in range(merged_base_page.num_records):
-                        current_rid = merged_base_page.indirection[i]
-                        while current_rid[3] == "t":
-                            tail_page = page_range.tail_pages[current_rid[1]]
-                            record_index = current_rid[2]
-                            for j in range(self.num_columns):
-                                if (
-                                    record_index < len(tail_page.schema_encoding)
-                                    and tail_page.schema_encoding[record_index][j]
-                                    == "1"
-                                    and j
-                                    not in updated_columns[merged_base_page.rid[i]]
-                                ):
-                                    value = tail_page.pages[j].read(record_index, 1)[0]
-                                    merged_base_page.pages[j].write(value)
-                                    updated_columns[merged_base_page.rid[i]].add(j)
-                                current_rid = tail_page.indirection[record_index]
-
-                    # Create new keys for the merged records
-                    new_keys = []
-                    
-                    if self.page_directory:
-                        current_max = max(self.page_directory.keys())
-                    else:
-                        current_max = 0
-                    for i in range(merged_base_page.num_records):
-                        current_max += 1
-                        new_key = current_max
-                        new_keys.append(new_key)
-                        self.page_directory[new_key] = self.page_directory[merged_base_page.rid[i]]
-                        self.page_directory[new_key].key = new_key
-
-                    # Update TPS for the merged base page
-                    merged_base_page.tps = max(
-                        tail_page.tps for tail_page in page_range.tail_pages
-                    )
+        """
+        Folds the tail records into fresh copies of the base pages, one page range at a time.
+        """
+        for page_range in list(self.page_ranges):
+            self.merge_page_range(page_range)
 
-                    # Add the merged base page to the list
-                    merged_base_pages.append(merged_base_page)
+    def merge_page_range(self, page_range):
+        """
+        Merge one page range. The table lock is only held to snapshot the latest version of every
+        base record and to swap the merged base pages in. The copies are built in between without
+        it, from values that don't change once written: the base columns of existing records and
+        the tail records. Updates made meanwhile stay reachable through the indirection column,
+        which the merged pages take over at the swap. The old pages are freed through the table's
+        epochs once no reader can be using them, so reads never wait for a merge.
+        """
+        # One merge of the table at a time, a merge started while another runs waits for it
+        with self.merge_lock:
+            self._merge_page_range(page_range)
 
-                # Replace old base pages with merged base pages
-                page_range.base_pages = merged_base_pages
-                page_range.num_base_pages = len(merged_base_pages)
+    def _merge_page_range(self, page_range):
+        with self.lock:
+            base_pages = list(page_range.base_pages)
+            # The base indirection is the latest-update map: base record -> its newest tail record
+            snapshots = [(base_page.num_records, base_page.indirection[:base_page.num_records]) for base_page in base_pages]
+            # Number of tail records in the range the merged pages include
+            tps = sum(tail_page.num_records for tail_page in page_range.tail_pages)
+
+        tail_columns = {}  # tail page number -> its columns, read through the bufferpool once
+        merged_base_pages = []
+        for base_page, (num_records, indirection) in zip(base_pages, snapshots):
+            merged_base_page = BasePage(self.num_columns)
+            for j in range(self.num_columns):
+                merged_base_page.pages[j].write_many(base_page.pages[j].column(0, num_records))
+            # Tail records hold every column, so the newest one replaces the whole record
+            for record_index, rid in enumerate(indirection):
+                if rid is None or len(rid) != 4 or rid[3] != "t":
+                    continue  # not updated, or deleted
+                if rid[1] not in tail_columns:
+                    tail_columns[rid[1]] = self._read_tail_columns(rid[0], rid[1])
+                for j, values in enumerate(tail_columns[rid[1]]):
+                    merged_base_page.pages[j].values[record_index] = values[rid[2]]
+            merged_base_page.tps = tps
+            merged_base_pages.append(merged_base_page)
 
-            # print("<----merging complete---->")
+        with self.lock:
+            for base_page, merged_base_page in zip(base_pages, merged_base_pages):
+                # Records inserted since the snapshot are copied as they are
+                for j in range(self.num_columns):
+                    merged_base_page.pages[j].write_many(base_page.pages[j].column(merged_base_page.pages[j].num_records))
+                merged_base_page.num_records = base_page.num_records
+                merged_base_page.rid = base_page.rid
+                merged_base_page.indirection = base_page.indirection
+                merged_base_page.schema_encoding = base_page.schema_encoding
+                merged_base_page.start_time = base_page.start_time
+            page_range.base_pages = merged_base_pages + page_range.base_pages[len(merged_base_pages):]
+
+        # Readers that started before the swap may still hold the old pages
+        self.epochs.retire(lambda: self._release_base_pages(base_pages))
+
+    @staticmethod
+    def _release_base_pages(base_pages):
+        # Drop the column buffers of replaced base pages, their other lists live on in the merged pages
+        for base_page in base_pages:
+            base_page.pages = []
+
+    def _read_tail_columns(self, page_range_id, page_id):
+        # Copy of every column of a tail page, whose in-memory mirror holds no values
+        page_identifier = ("tail", page_range_id, page_id)
+        columns = self.database.bufferpool.read_columns(
+            page_identifier, self.name, range(self.num_columns), sequential=True
+        )
+        return [list(values) for values in columns or [[]] * self.num_columns]
 
     def read_column_from_page(
         self, page_range_id, page_id, column_id, record_id, is_base_page=True
@@ -403,29 +585,11 @@ class Table:
         page_type = "base" if is_base_page else "tail"
         page_identifier = (page_type, page_range_id, page_id)
 
-        # Get the page from bufferpool
-        page_data = self.database.bufferpool.get_page(
-            page_identifier, self.name, self.num_columns
+        # Read through the bufferpool without loading the page, None if the value doesn't exist
+        return self.database.bufferpool.read_value(
+            page_identifier, self.name, column_id, record_id
         )
 
-        # Check if the data exists
-        if "columns" not in page_data:
-            return None
-
-        if column_id >= len(page_data["columns"]):
-            return None
-
-        if record_id >= len(page_data["columns"][column_id]):
-            return None
-
-        # Extract the column value
-        value = page_data["columns"][column_id][record_id]
-
-        # Unpin the page when done
-        self.database.bufferpool.unpin_page(page_identifier, self.name)
-
-        return value
-
     def write_column_to_page(
         self, page_range_id, page_id, column_id, record_id, value, is_base_page=True
     ):
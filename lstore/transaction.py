@@ -2,19 +2,21 @@ from lstore.table import Table, Record
 from lstore.index import Index
 from lstore.query import Query
 from lstore.db import LockManager
-import os
 from threading import RLock
 
+# Queries that don't change a table and are left out of the write-ahead log
+READ_ONLY_QUERIES = ("select", "select_version", "sum", "sum_version")
+
 class Transaction:
     def __init__(self, transaction_id=None, buffer_pool=None, lock_manager=None):
         self.transaction_id = transaction_id if transaction_id is not None else id(self)  # Unique ID for transaction
         self.queries = []  # List to store queries and their arguments
-        self.rollback_operations = []  # List of tuples to store operations for rollback
+        self.rollback_operations = []  # (table, key now, before-image, after-image) of every change made so far
         self.buffer_pool = buffer_pool  # Reference to buffer pool
         self.lock_manager = lock_manager  # Reference to lock manager
+        self.log = None  # Write-ahead log of the database
         self.locks_held = set()  # Set to track locks held by this transaction
         self.mutex = RLock()  # Mutex Lock for thread-safe log writes
-        self._deleted_records = {} # Deleted records for rollback
 
     def add_query(self, query, table, *args):
         with self.mutex:
@@ -23,58 +25,60 @@ class Transaction:
                 self.buffer_pool = table.database.bufferpool
             if self.lock_manager is None and hasattr(table, 'database') and table.database is not None:
                 self.lock_manager = table.database.lock_manager
+            if self.log is None and hasattr(table, 'database') and table.database is not None:
+                self.log = table.database.log
 
-            # Store querying changes and its arguments as well as current state for potential rollback
+            # Store querying changes and its arguments. Rollback works from the images logged as they run.
             self.queries.append((query, table, args))
-            if query.__name__ == "update":
-                original_state = self._get_record_columns(table, args[0])
-                if original_state is not None:
-                    # Make a copy so that changes do not affect the stored state
-                    original_state = list(original_state)
-                    self.rollback_operations.append((lambda key, original_state=original_state: Query(table).update(key, *original_state), args))
-                else:
-                    self.rollback_operations.append((lambda key: None, args))
-            # For insert queries, we rollback by deleting the inserted record
-            elif query.__name__ == "insert":
-                self.rollback_operations.append((lambda key: Query(table).delete(key), args))
-            # For delete queries, since we might need to re-insert it we can store it
-            elif query.__name__ == "delete":
-                self.rollback_operations.append((lambda key: self._restore_deleted_record(table, key), args))
-
-    # Helper function for possible rollback
-    def _get_rollback_operation(self, query, table, args):
-        # Store the operations
-        if query.__name__ == "insert":
-            return lambda key: Query(table).delete(key)
-        elif query.__name__ == "update":
-            return lambda key: self._restore_previous_version(table, key)
-        elif query.__name__ == "delete":
-            return lambda key: self._restore_deleted_record(table, key)
-        return lambda *args: None
-
-    # Helper function for update rollback
-    def _restore_previous_version(self, table, key):
-        with self.mutex:
-            columns = self._get_record_columns(table, key)
-            if columns is not None:
-                Query(table).update(key, *columns)
 
-
-    # Helper function for delete rollback
-    def _restore_deleted_record(self, table, key):
-        with self.mutex:
-            if key in self._deleted_records:
-                Query(table).insert(*self._deleted_records[key])
-
-    # Get the columns of a record given its primary key.
-    def _get_record_columns(self, table, key):
-        if self.buffer_pool is None and hasattr(table, 'database') and table.database is not None:
-            self.buffer_pool = table.database.bufferpool
-        rids = table.index.locate(table.key, key)
-        if not rids or rids[0] not in table.page_directory:
-            return None
-        record = table.page_directory[rids[0]]
-        return record.columns
+    # Roll back one change by bringing its record back to the before-image. The rollback is logged
+    # like a query, as a compensation record, so recovery redoes it instead of undoing the change again.
+    def _roll_back(self, table, key, before, after):
+        query = Query(table)
+        self._log_intent(table, key, compensation=True)
+        if after is None:
+            # Delete: put the record back
+            if before is not None:
+                query.insert(*before)
+        elif before is None:
+            # Insert: remove the record
+            query.delete(key)
+        else:
+            # Update, which also moves the record back to its old key if the update changed it
+            query.update(key, *before)
+        if self.log is not None:
+            after_key = key if before is None else before[table.key]
+            self.log.log_query(self.transaction_id, table.name, key, after, self._record_image(table, after_key), compensation=True)
+
+    # Latest version of a record's columns, or None if no record has the key
+    def _record_image(self, table, key):
+        return Query(table)._get_latest_columns(key)
+
+    # Key of the record a query works on
+    def _query_key(self, query, table, args):
+        if query.__name__ == "insert":
+            return args[table.key]
+        return args[0]
+
+    # Log the before-image of the record a query is about to change, and return it
+    def _log_intent(self, table, key, compensation=False):
+        before = self._record_image(table, key)
+        if self.log is None:
+            return before
+        if getattr(table, 'database', None) is not None:
+            table.database.log_table(table)
+        self.log.log_intent(self.transaction_id, table.name, key, before, compensation)
+        return before
+
+    # Log the before and after image of the record a query changed, and return (its key now, after-image)
+    def _log_query(self, query, table, args, key, before):
+        after_key = key
+        if query.__name__ == "update" and len(args) > table.key + 1 and args[table.key + 1] is not None:
+            after_key = args[table.key + 1]
+        after = self._record_image(table, after_key)
+        if self.log is not None:
+            self.log.log_query(self.transaction_id, table.name, key, before, after)
+        return after_key, after
 
     def run(self):
         with self.mutex:
@@ -95,6 +99,8 @@ class Transaction:
                     self.buffer_pool = first_table.database.bufferpool
                 if self.lock_manager is None and hasattr(first_table, 'database'):
                     self.lock_manager = first_table.database.lock_manager
+                if self.log is None and hasattr(first_table, 'database'):
+                    self.log = first_table.database.log
                     
             if self.lock_manager is None:
                 print("Failed to get lock_manager")
@@ -116,15 +122,12 @@ class Transaction:
             for i, (query, table, args) in enumerate(self.queries):
                 # print(f"Executing query {i+1}/{len(self.queries)}: {query.__name__}")
                 
-                # Store the query if it is delete
-                if query.__name__ == "delete":
-                    columns = self._get_record_columns(table, args[0])
-                    if columns is not None:
-                        self._deleted_records[args[0]] = columns
-                # Store the query if it is insert
-                elif query.__name__ == "insert":
-                    self._deleted_records[args[0]] = args
-                    
+                # Log the before-image while the lock is held, ahead of any page the query dirties
+                logged = query.__name__ not in READ_ONLY_QUERIES
+                if logged:
+                    key = self._query_key(query, table, args)
+                    before = self._log_intent(table, key)
+
                 # Execute the query
                 result = query(*args)
                 # print(f"Query result: {result}")
@@ -132,16 +135,22 @@ class Transaction:
                 if result is False:
                     print(f"Query {i+1} failed, aborting transaction")
                     return self.abort()  # Ensure abort returns False
+
+                if logged:
+                    after_key, after = self._log_query(query, table, args, key, before)
+                    self.rollback_operations.append((table, after_key, before, after))
                     
             # print(f"All queries succeeded, committing transaction {self.transaction_id}")
             return self.commit()  # Ensure commit returns True
 
     def abort(self):
         # This function returns false if something is aborted
-        # Roll back changes by executing rollback operations in reverse order
+        # Roll back the changes made so far, newest first, while the locks are still held
         with self.mutex:
-            for operation, args in reversed(self.rollback_operations):
-                operation(args[0])
+            for table, key, before, after in reversed(self.rollback_operations):
+                self._roll_back(table, key, before, after)
+            if self.log is not None:
+                self.log.abort(self.transaction_id)
 
             for record_id in self.locks_held:
                 self.lock_manager.release_lock(self.transaction_id, record_id)
@@ -149,33 +158,18 @@ class Transaction:
             self.queries.clear()
             self.rollback_operations.clear()
             self.locks_held.clear()
-            self._deleted_records.clear()
             return False
 
     def commit(self):
         # This function returns true if commit succeeds
         with self.mutex:
-            self._write_to_transaction_log()
-            self._flush_dirty_pages()
+            # Only the log is forced, the dirty pages stay in the bufferpool for the background writer
+            if self.log is not None:
+                self.log.commit(self.transaction_id)
 
             for record_id in self.locks_held:
                 self.lock_manager.release_lock(self.transaction_id, record_id)
             self.queries.clear()
             self.rollback_operations.clear()
             self.locks_held.clear()
-            self._deleted_records.clear()
             return True
-
-    def _write_to_transaction_log(self):
-        # Writes to the log to save all transactions
-        with self.mutex:
-            with open("transaction_log.txt", "a") as log_file:
-                for query, table, args in self.queries:
-                    log_file.write(f"Transaction {self.transaction_id}: Query {query.__name__}, Table {table.name}, Args {args}\n")
-                # Flush log to disk to ensure durability
-                os.fsync(log_file.fileno())
-
-    def _flush_dirty_pages(self):
-        # Flush all dirty pages if safe
-        with self.mutex:
-            self.buffer_pool.reset()
@@ -0,0 +1,41 @@
+from lstore.page import LogicalPage, INT64_MIN, INT64_MAX
+
+# Checks which values a LogicalPage accepts: signed 64-bit integers, one at a time or as a run.
+
+
+def check(name, result, correct):
+    if result != correct:
+        print(name, 'error:', result, ', correct:', correct)
+        return 0
+    return 1
+
+
+def rejects(write, value):
+    try:
+        write(value)
+    except OverflowError:
+        return True
+    return False
+
+
+score = 0
+total = 0
+
+values = [INT64_MIN, -1, 0, 1, 92106429, INT64_MAX]
+page = LogicalPage()
+for value in values:
+    page.write(value)
+score += check('write', page.read(0, len(values)), values)
+page = LogicalPage()
+page.write_many(values)
+score += check('write_many', page.column().tolist(), values)
+total += 2
+
+for value in (INT64_MAX + 1, 2 ** 64 - 1, INT64_MIN - 1):
+    page = LogicalPage()
+    score += check('write ' + str(value), rejects(page.write, value), True)
+    score += check('write_many ' + str(value), rejects(page.write_many, [0, value]), True)
+    score += check('nothing written for ' + str(value), page.num_records, 0)
+    total += 3
+
+print('Score', score, '/', total)
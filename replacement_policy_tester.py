@@ -0,0 +1,85 @@
+from lstore.replacement import LRUPolicy, ClockPolicy, TwoQueuePolicy, ARCPolicy
+
+# Checks the order in which each buffer replacement policy evicts frames, without a database.
+# A frame is "accessed" the way the Bufferpool does it: pinned, then unpinned once its pin count is zero.
+
+
+def access(policy, key, sequential=False):
+    policy.pinned(key, sequential)
+    policy.unpinned(key)
+
+
+def victims(policy, count):
+    return [policy.victim() for _ in range(count)]
+
+
+def check(name, result, correct):
+    if result != correct:
+        print(name, 'error:', result, ', correct:', correct)
+        return 0
+    return 1
+
+
+score = 0
+total = 0
+
+# LRU: a hit moves a page to the hot end, a sequential page goes to the cold end
+policy = LRUPolicy(8)
+for key in 'abc':
+    access(policy, key)
+access(policy, 'a')
+score += check('LRU hit', victims(policy, 4), ['b', 'c', 'a', None])
+access(policy, 'a')
+access(policy, 's', sequential=True)
+access(policy, 'b')
+score += check('LRU scan', victims(policy, 3), ['s', 'a', 'b'])
+total += 2
+
+# CLOCK: the hand clears reference bits on its way and takes the first frame without one
+policy = ClockPolicy(8)
+for key in 'abc':
+    access(policy, key)
+first = policy.victim()
+access(policy, 'b')
+score += check('CLOCK second chance', [first] + victims(policy, 3), ['a', 'c', 'b', None])
+access(policy, 'a')
+access(policy, 's', sequential=True)
+score += check('CLOCK scan', victims(policy, 2), ['s', 'a'])
+total += 2
+
+# 2Q: A1in is a FIFO, so a hit there doesn't save a page; a hit after it left A1in promotes it to Am
+policy = TwoQueuePolicy(8)  # A1in holds 2 frames
+for key in 'abc':
+    access(policy, key)
+access(policy, 'a')
+score += check('2Q A1in hit', policy.victim(), 'a')
+access(policy, 'a')  # remembered in A1out, so it goes to Am
+access(policy, 'd')
+policy.pinned('b')  # b stays pinned, so it is skipped without losing its place
+score += check('2Q pinned', victims(policy, 4), ['c', 'a', 'd', None])
+policy.unpinned('b')
+score += check('2Q unpinned', policy.victim(), 'b')
+policy = TwoQueuePolicy(8)
+access(policy, 'a')
+access(policy, 's', sequential=True)
+first = policy.victim()
+access(policy, 's')  # a scan page leaves no ghost behind, so it starts over in A1in
+score += check('2Q scan', [first] + victims(policy, 2), ['s', 'a', 's'])
+total += 4
+
+# ARC: a second hit moves a page to T2, and a hit on a ghost of T1 grows T1's target size
+policy = ARCPolicy(4)
+access(policy, 'a')
+access(policy, 'b')
+access(policy, 'a')
+first = policy.victim()
+access(policy, 'b')  # ghost hit in B1
+access(policy, 'c')
+score += check('ARC', [first] + victims(policy, 4), ['b', 'a', 'b', 'c', None])
+policy = ARCPolicy(4)
+access(policy, 'a')
+access(policy, 's', sequential=True)
+score += check('ARC scan', victims(policy, 2), ['s', 'a'])
+total += 2
+
+print('Score', score, '/', total)